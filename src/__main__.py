@@ -0,0 +1,6 @@
+import sys
+
+from cli import main
+
+# Permite ejecutar el directorio directamente: python src <comando> [opciones]
+sys.exit(main())
@@ -1,148 +1,149 @@
 import json
-import requests
-import time
 import logging
-from os import getenv
-from dotenv import load_dotenv
+import sys
+
+from compression import wire_size
+from metrics import RunMetrics
+from profiling import Profiler
+from sicop import (ENDPOINTS, auth_headers, credentials_from_env, get_access_token, get_env_var,
+                   request_with_retry)
+from snapshot import SnapshotGuard
+from spill import SpillBuffer
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-load_dotenv()
-
-def get_env_var(key: str, default: str = "") -> str:
-    value = getenv(key, default)
-    if not value:
-        print(f"Advertencia: la variable de entorno '{key}' no está definida. Usando valor por defecto.")
-    return value
-
-EMAIL_USER = get_env_var("EMAIL_USER")
-PWD_USER   = get_env_var("PWD_USER")
-CLIENT_ID  = get_env_var("CLIENT_ID")
-SECRET_KEY = get_env_var("SECRET_KEY")
-MARCA      = get_env_var("MARCA")
-
-URL_AUTH_ENDPOINT = "https://api.sicopweb.com/auth/v3/token"
-URL_ENDPOINT_SERVICE = f"https://api.sicopweb.com/bi/prod/indicadores/{MARCA}/nacional"
-
-class UserCredentials:
-    def __init__(self, email: str, pwd: str):
-        self.email = email
-        self.pwd = pwd
-
-class ClientCredentials:
-    def __init__(self, client_id: str, secret_key: str):
-        self.client_id = client_id
-        self.secret_key = secret_key
-
-def get_access_token(userCredentials: UserCredentials, clientCredentials: ClientCredentials):
-    # Credenciales de acceso
-    data = {
-        'email': userCredentials.email,
-        'pwd': userCredentials.pwd,
-        'client_id': clientCredentials.client_id,
-        'secret_key': clientCredentials.secret_key
-    }
-    # Encabezados de la solicitud
-    headers = {"Content-type": "application/x-www-form-urlencoded"}
+MARCA = get_env_var("MARCA")
 
-    try:
-        response = requests.post(URL_AUTH_ENDPOINT, data=data, headers=headers)
-        response.raise_for_status()
-        respuesta_json = response.json()
-        token = respuesta_json.get("token")
-        if not token:
-            raise ValueError("Token no presente en la respuesta")
-        return token
-    except Exception as e:
-        logging.error(f"Error al obtener el token de acceso: {e}")
-        return None
+ENDPOINT = ENDPOINTS["indicadores"]
 
-def get_data(request_body, headers):
+# Parámetros de la consulta; main() acepta sobrescribirlos (p. ej. desde cli.py)
+COMMON_PARAMS = {
+    "fbyfechaini": "20260301",
+    "fbyfechafin": "20260316",
+    "frecuencia": "DIARIA",
+    "gby": "zona,region,plaza,distribuidor,auto,fuenteinformacion,subcampana"
+}
+
+def get_data(url, request_body, headers, metrics=None):
     payload = json.dumps(request_body)
-    response = requests.post(URL_ENDPOINT_SERVICE, headers=headers, data=payload)
-    response.raise_for_status()
-    return response
+    return request_with_retry('POST', url, metrics, headers=headers, data=payload)
 
-start_time = time.time()
+def main(marca: str = None, params: dict = None):
+    marca = marca or MARCA
+    metrics = RunMetrics("app", {"marca": marca})
+    profiler = Profiler.from_env("app").start()
+    url = ENDPOINT.url(marca)
 
-user = UserCredentials(email=EMAIL_USER,pwd=PWD_USER)
-client = ClientCredentials(client_id=CLIENT_ID,secret_key=SECRET_KEY)
-#Obtenemos el token de acceso
-token = get_access_token(user, client)
+    user, client = credentials_from_env()
+    #Obtenemos el token de acceso
+    with metrics.phase("auth"):
+        token = get_access_token(user, client)
 
-if not token:
-    exit(1)
+    if not token:
+        profiler.stop()
+        return 1
 
-#Encabezados necesarios con token de acceso
-headers = {
-  'Content-Type': 'application/json',
-  'Authorization': f'Bearer {token}'
-}
+    #Encabezados necesarios con token de acceso
+    headers = auth_headers(token)
 
-try:
-    # Primer peticion para obtener datos
-    current_page = 1
-    common_params = {
-        "fbyfechaini": "20260301",
-        "fbyfechafin": "20260316",
-        "frecuencia": "DIARIA",
-        "gby": "zona,region,plaza,distribuidor,auto,fuenteinformacion,subcampana"
-    }
-    params = {**common_params, "page": current_page}
-
-    fulldata = []
-    logging.info('Solicitando datos...')
-    response = get_data(params, headers)
-    total_pages = int(response.headers.get('x-sicop-api-pages', 1))
-    current_page = int(response.headers.get('x-sicop-api-current-page', 1))
-
-    #Parseamos el resultado
-    data = response.json()
-    if not isinstance(data, list):
-        raise ValueError("Respuesta inesperada: se esperaba una lista de diccionarios.")
-
-    fulldata.extend(data)
-    #Solo imprimir el total de elementos descargados en la iteraccion
-    logging.info(f'Página: {current_page} de {total_pages}, Total Items: {len(data)}')
-    # Recorrido para obtener resto de paginas
-    while(current_page < total_pages):
-        current_page += 1
+    try:
+        # Primer peticion para obtener datos
+        current_page = 1
+        common_params = {**COMMON_PARAMS, **(params or {})}
         params = {**common_params, "page": current_page}
-        try:
-            response = get_data(params, headers)
-            current_page = int(response.headers.get('x-sicop-api-current-page', current_page))
+
+        # Con MEMORY_BUDGET_ROWS las páginas pasan a disco al rebasar el presupuesto
+        fulldata = SpillBuffer.from_env()
+        logging.info('Solicitando datos...')
+        with metrics.phase("network") as page_timer:
+            response = get_data(url, params, headers, metrics)
+        total_pages = int(response.headers.get('x-sicop-api-pages', 1))
+        guard = SnapshotGuard(total_pages)
+        current_page = int(response.headers.get('x-sicop-api-current-page', 1))
+
+        #Parseamos el resultado
+        with metrics.phase("decode") as decode_timer:
             data = response.json()
-            if not isinstance(data, list):
-                raise ValueError("Respuesta inesperada en iteración de páginas.")
-            #Solo imprimir el total de elementos descargados en la iteraccion
-            logging.info(f'Página: {current_page} de {total_pages}, Total Items: {len(data)}')
-            fulldata.extend(data)
-        except Exception as e:
-            logging.error(f"Error en la página {current_page}: {e}")
-
-    logging.info(f'Total Items: {len(fulldata)}')
-
-    # Determinar anio, mes y dia máximos recibidos en la respuesta
-    max_anio = max(int(row['anio']) for row in fulldata)
-    max_mes = max(int(row['mes']) for row in fulldata if int(row['anio']) == max_anio)
-    max_dia = max(int(row['dia']) for row in fulldata if int(row['anio']) == max_anio and int(row['mes']) == max_mes)
-    logging.info(f'Fecha máxima recibida: {max_anio}/{max_mes:02d}/{max_dia:02d}')
-
-    # Calculamos total de prospectos acumulados en fulldata
-    total_prospectos = 0
-    total_prospectos_piso = 0
-    total_prospectos_digitales = 0
-
-    for row in fulldata:
-        total_prospectos += int(row['prospectos'])
-        total_prospectos_piso += int(row['prospectospiso'])
-        total_prospectos_digitales += int(row['leads'])
-
-    logging.info(f'Prospectos: {total_prospectos}')
-    logging.info(f'ProspectosPiso: {total_prospectos_piso}')
-    logging.info(f'ProspectosDigitales: {total_prospectos_digitales}')
-except Exception as e:
-    logging.error(f"Error General: {e}")
-
-logging.info(f'Tiempo Total: {time.time() - start_time} s')
\ No newline at end of file
+        if not isinstance(data, list):
+            raise ValueError("Respuesta inesperada: se esperaba una lista de diccionarios.")
+        metrics.record_page(page_timer.elapsed, len(response.content), len(data), wire_size(response),
+                            decode_timer.elapsed)
+
+        fulldata.extend(guard.unique(data))
+        #Solo imprimir el total de elementos descargados en la iteraccion
+        logging.info(f'Página: {current_page} de {total_pages}, Total Items: {len(data)}')
+        # Recorrido para obtener resto de paginas
+        while(current_page < total_pages):
+            current_page += 1
+            params = {**common_params, "page": current_page}
+            try:
+                with metrics.phase("network") as page_timer:
+                    response = get_data(url, params, headers, metrics)
+                total_pages, restart = guard.check(response)
+                if restart:
+                    # El conjunto cambió: se descarta lo acumulado y se vuelve a la primera página
+                    metrics.record_refetch(current_page - 1)
+                    fulldata.clear()
+                    current_page = 0
+                    continue
+                current_page = int(response.headers.get('x-sicop-api-current-page', current_page))
+                with metrics.phase("decode") as decode_timer:
+                    data = response.json()
+                if not isinstance(data, list):
+                    raise ValueError("Respuesta inesperada en iteración de páginas.")
+                metrics.record_page(page_timer.elapsed, len(response.content), len(data), wire_size(response),
+                                    decode_timer.elapsed)
+                #Solo imprimir el total de elementos descargados en la iteraccion
+                logging.info(f'Página: {current_page} de {total_pages}, Total Items: {len(data)}')
+                fulldata.extend(guard.unique(data))
+            except Exception as e:
+                metrics.record_error()
+                logging.error(f"Error en la página {current_page}: {e}")
+
+        if guard.duplicates:
+            metrics.record_duplicates(guard.duplicates)
+            logging.warning(f"Filas repetidas entre páginas descartadas: {guard.duplicates}")
+
+        logging.info(f'Total Items: {len(fulldata)}')
+        fulldata.log_summary()
+        profiler.snapshot("download")
+
+        with metrics.phase("aggregation"):
+            # Calculamos total de prospectos acumulados en fulldata y la fecha máxima
+            # recibida en un solo recorrido (fulldata puede estar en disco)
+            max_fecha = None
+            total_prospectos = 0
+            total_prospectos_piso = 0
+            total_prospectos_digitales = 0
+
+            for row in fulldata:
+                fecha = (int(row['anio']), int(row['mes']), int(row['dia']))
+                if max_fecha is None or fecha > max_fecha:
+                    max_fecha = fecha
+                total_prospectos += int(row['prospectos'])
+                total_prospectos_piso += int(row['prospectospiso'])
+                total_prospectos_digitales += int(row['leads'])
+            if max_fecha is None:
+                raise ValueError("No se recibieron datos")
+            max_anio, max_mes, max_dia = max_fecha
+            logging.info(f'Fecha máxima recibida: {max_anio}/{max_mes:02d}/{max_dia:02d}')
+        profiler.snapshot("aggregation")
+
+        logging.info(f'Prospectos: {total_prospectos}')
+        logging.info(f'ProspectosPiso: {total_prospectos_piso}')
+        logging.info(f'ProspectosDigitales: {total_prospectos_digitales}')
+    except Exception as e:
+        logging.error(f"Error General: {e}")
+    finally:
+        if 'fulldata' in locals():
+            fulldata.close()
+
+    profiler.stop()
+    metrics.log_summary()
+    metrics.export()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
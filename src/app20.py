@@ -1,34 +1,59 @@
 import json
-import mysql.connector
-import requests
-import time
 import logging
+import sys
 from os import getenv
 from os.path import join
-from dotenv import load_dotenv
+
+from compression import wire_size
+from metrics import RunMetrics
+from profiling import Profiler
+from sicop import (ENDPOINTS, auth_headers, credentials_from_env, get_access_token, get_env_var,
+                   request_with_retry)
+from snapshot import SnapshotGuard
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Cargar variables de entorno
-load_dotenv()
-
 USER_HOME = getenv("HOME") or getenv("USERPROFILE") or "."
 
-def get_env_var(key: str, default: str = "") -> str:
-    value = getenv(key, default)
-    if not value:
-        logging.warning(f"La variable de entorno '{key}' no está definida o vacía. Usando valor por defecto.")
-    return value
+MARCA = get_env_var("MARCA")
 
-EMAIL_USER = get_env_var("EMAIL_USER")
-PWD_USER   = get_env_var("PWD_USER")
-CLIENT_ID  = get_env_var("CLIENT_ID")
-SECRET_KEY = get_env_var("SECRET_KEY")
-MARCA      = get_env_var("MARCA")
+ENDPOINT = ENDPOINTS["indicadores20"]
+
+# Parámetros de la consulta; main() acepta sobrescribirlos (p. ej. desde cli.py)
+COMMON_PARAMS = {
+    "fbyfechaini": "20251201",
+    "fbyfechafin": "20251208",
+    "frecuencia": "DIARIA",
+    "gby": "zona,region,plaza,distribuidor,auto,fuenteinformacion,subcampana,ejecutivo"
+}
 
-URL_AUTH_ENDPOINT = "https://api.sicopweb.com/auth/v3/token"
-URL_ENDPOINT_SERVICE = f"https://api.sicopweb.com/bi/prod/indicadores20/{MARCA}/nacional"
+INSERT_QUERY = """
+INSERT INTO sicopdb.analisisdiariobdc(
+    anio, mes, dia, fecha,
+    codigomarca, zona, region, plaza, distribuidor,
+    fuenteinformacion, subcampana,
+    idejecutivo, ejecutivo,
+    recibidos, intentados,
+    intentadosminutos, tiempopromediointentados,
+    contactados, asignados, citas,
+    citasregistradas, `show`, confirmaciondecitas,
+    ventas, ventasfacturadas
+)
+VALUES (
+    %(anio)s, %(mes)s, %(dia)s, %(fecha)s,
+    %(codigomarca)s, %(zona)s, %(region)s, %(plaza)s, %(distribuidor)s,
+    %(fuenteinformacion)s, %(subcampana)s,
+    %(idejecutivo)s, %(ejecutivo)s,
+    %(recibidos)s, %(intentados)s,
+    %(intentadosminutos)s, %(tiempopromediointentados)s,
+    %(contactados)s, %(asignados)s, %(citas)s,
+    %(citasregistradas)s, %(show)s, %(confirmaciondecitas)s,
+    %(ventas)s, %(ventasfacturadas)s
+)"""
+
+# Filas por executemany al cargar desde un sink (runner.py); app20.main inserta por página
+INSERT_BATCH_ROWS = 5000
 
 def loadConf(conf_file: str):
     separator = "="
@@ -40,44 +65,12 @@ def loadConf(conf_file: str):
                 keys[name.strip()] = value.strip()
     return keys
 
-class UserCredentials:
-    def __init__(self, email: str, pwd: str):
-        self.email = email
-        self.pwd = pwd
-
-class ClientCredentials:
-    def __init__(self, client_id: str, secret_key: str):
-        self.client_id = client_id
-        self.secret_key = secret_key
-
-def get_access_token(userCredentials: UserCredentials, clientCredentials: ClientCredentials):
-    data = {
-        'email': userCredentials.email,
-        'pwd': userCredentials.pwd,
-        'client_id': clientCredentials.client_id,
-        'secret_key': clientCredentials.secret_key
-    }
-    headers = {"Content-type": "application/x-www-form-urlencoded"}
-
-    try:
-        response = requests.post(URL_AUTH_ENDPOINT, data=data, headers=headers)
-        response.raise_for_status()
-        respuesta_json = response.json()
-        token = respuesta_json.get("token")
-        if not token:
-            raise ValueError("Token no presente en la respuesta")
-        return token
-    except Exception as e:
-        logging.error(f"Error al obtener el token de acceso: {e}")
-        return None
-
-def get_data(request_body, headers):
+def get_data(url, request_body, headers, metrics=None):
     payload = json.dumps(request_body)
-    response = requests.post(URL_ENDPOINT_SERVICE, headers=headers, data=payload)
-    response.raise_for_status()
-    return response
+    return request_with_retry('POST', url, metrics, headers=headers, data=payload)
 
 def truncate_data(connection):
+    import mysql.connector
     try:
         cursor = connection.cursor()
         cursor.execute("TRUNCATE TABLE sicopdb.analisisdiariobdc")
@@ -89,6 +82,7 @@ def truncate_data(connection):
         cursor.close()
 
 def batch_insert_with_dicts(connection, insert_query, data):
+    import mysql.connector
     try:
         cursor = connection.cursor()
         cursor.executemany(insert_query, data)
@@ -100,26 +94,10 @@ def batch_insert_with_dicts(connection, insert_query, data):
     finally:
         cursor.close()
 
-start_time = time.time()
-
-user = UserCredentials(email=EMAIL_USER, pwd=PWD_USER)
-client = ClientCredentials(client_id=CLIENT_ID, secret_key=SECRET_KEY)
-#Obtenemos el token de acceso
-token = get_access_token(user, client)
-
-if not token:
-    exit(1)
-
-headers = {
-    'Content-Type': 'application/json',
-    'Authorization': f'Bearer {token}'
-}
-
-try:
-    conf_path = join(USER_HOME, '.mysql', 'prod.conf')
-    conf = loadConf(conf_path)
-
-    conn = mysql.connector.connect(
+def connect():
+    import mysql.connector
+    conf = loadConf(join(USER_HOME, '.mysql', 'prod.conf'))
+    return mysql.connector.connect(
         user=conf.get('user'),
         password=conf.get('password'),
         host='localhost',
@@ -127,70 +105,114 @@ try:
         database='sicopdb'
     )
 
-    insert_query = """
-    INSERT INTO sicopdb.analisisdiariobdc(
-        anio, mes, dia, fecha,
-        codigomarca, zona, region, plaza, distribuidor,
-        fuenteinformacion, subcampana,
-        idejecutivo, ejecutivo,
-        recibidos, intentados,
-        intentadosminutos, tiempopromediointentados,
-        contactados, asignados, citas,
-        citasregistradas, `show`, confirmaciondecitas,
-        ventas, ventasfacturadas
-    )
-    VALUES (
-        %(anio)s, %(mes)s, %(dia)s, %(fecha)s,
-        %(codigomarca)s, %(zona)s, %(region)s, %(plaza)s, %(distribuidor)s,
-        %(fuenteinformacion)s, %(subcampana)s,
-        %(idejecutivo)s, %(ejecutivo)s,
-        %(recibidos)s, %(intentados)s,
-        %(intentadosminutos)s, %(tiempopromediointentados)s,
-        %(contactados)s, %(asignados)s, %(citas)s,
-        %(citasregistradas)s, %(show)s, %(confirmaciondecitas)s,
-        %(ventas)s, %(ventasfacturadas)s
-    )"""
-
-    common_params = {
-        "fbyfechaini": "20251201",
-        "fbyfechafin": "20251208",
-        "frecuencia": "DIARIA",
-        "gby": "zona,region,plaza,distribuidor,auto,fuenteinformacion,subcampana,ejecutivo"
-    }
-
-    current_page = 1
-    request_body = {**common_params, "page": current_page}
-
-    response = get_data(request_body, headers)
-    total_pages = int(response.headers.get('x-sicop-api-pages', 1))
-    current_page = int(response.headers.get('x-sicop-api-current-page', 1))
-
-    data = response.json()
-    if not isinstance(data, list):
-        raise ValueError("Respuesta inesperada: se esperaba una lista de diccionarios.")
-
-    truncate_data(conn)
-    logging.info(f'Página: {current_page} de {total_pages}, Total Items: {len(data)}')
-    batch_insert_with_dicts(conn, insert_query, data)
-
-    while current_page < total_pages:
-        current_page += 1
+def load_rows(rows, append: bool = False):
+    """Carga filas de indicadores20 en sicopdb.analisisdiariobdc; sin append vacía la tabla antes, como main()."""
+    conn = connect()
+    try:
+        if not append:
+            truncate_data(conn)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= INSERT_BATCH_ROWS:
+                batch_insert_with_dicts(conn, INSERT_QUERY, batch)
+                batch = []
+        if batch:
+            batch_insert_with_dicts(conn, INSERT_QUERY, batch)
+    finally:
+        conn.close()
+
+def main(marca: str = None, params: dict = None):
+    marca = marca or MARCA
+    metrics = RunMetrics("app20", {"marca": marca})
+    profiler = Profiler.from_env("app20").start()
+    url = ENDPOINT.url(marca)
+
+    user, client = credentials_from_env()
+    #Obtenemos el token de acceso
+    with metrics.phase("auth"):
+        token = get_access_token(user, client)
+
+    if not token:
+        profiler.stop()
+        return 1
+
+    headers = auth_headers(token)
+
+    # mysql.connector se importa aquí para que importar el módulo (o --dry-run) no lo cargue
+    import mysql.connector
+    try:
+        with metrics.phase("db_connect"):
+            conn = connect()
+
+        common_params = {**COMMON_PARAMS, **(params or {})}
+
+        current_page = 1
         request_body = {**common_params, "page": current_page}
-        try:
-            response = get_data(request_body, headers)
-            current_page = int(response.headers.get('x-sicop-api-current-page', current_page))
+
+        with metrics.phase("network") as page_timer:
+            response = get_data(url, request_body, headers, metrics)
+        total_pages = int(response.headers.get('x-sicop-api-pages', 1))
+        guard = SnapshotGuard(total_pages)
+        current_page = int(response.headers.get('x-sicop-api-current-page', 1))
+
+        with metrics.phase("decode") as decode_timer:
             data = response.json()
-            if not isinstance(data, list):
-                raise ValueError("Respuesta inesperada en iteración de páginas.")
-            logging.info(f'Página: {current_page} de {total_pages}, Total Items: {len(data)}')
-            batch_insert_with_dicts(conn, insert_query, data)
-        except Exception as e:
-            logging.error(f"Error en la página {current_page}: {e}")
-
-except mysql.connector.Error as err:
-    logging.error(f"Error de conexión a base de datos: {err}")
-finally:
-    if 'conn' in locals() and conn.is_connected():
-        conn.close()
+        if not isinstance(data, list):
+            raise ValueError("Respuesta inesperada: se esperaba una lista de diccionarios.")
+        metrics.record_page(page_timer.elapsed, len(response.content), len(data), wire_size(response),
+                            decode_timer.elapsed)
+
+        logging.info(f'Página: {current_page} de {total_pages}, Total Items: {len(data)}')
+        with metrics.phase("insert"):
+            truncate_data(conn)
+            batch_insert_with_dicts(conn, INSERT_QUERY, guard.unique(data))
+
+        while current_page < total_pages:
+            current_page += 1
+            request_body = {**common_params, "page": current_page}
+            try:
+                with metrics.phase("network") as page_timer:
+                    response = get_data(url, request_body, headers, metrics)
+                total_pages, restart = guard.check(response)
+                if restart:
+                    # El conjunto cambió: se vacía la tabla otra vez y se vuelve a la primera página
+                    metrics.record_refetch(current_page - 1)
+                    with metrics.phase("insert"):
+                        truncate_data(conn)
+                    current_page = 0
+                    continue
+                current_page = int(response.headers.get('x-sicop-api-current-page', current_page))
+                with metrics.phase("decode") as decode_timer:
+                    data = response.json()
+                if not isinstance(data, list):
+                    raise ValueError("Respuesta inesperada en iteración de páginas.")
+                metrics.record_page(page_timer.elapsed, len(response.content), len(data), wire_size(response),
+                                    decode_timer.elapsed)
+                logging.info(f'Página: {current_page} de {total_pages}, Total Items: {len(data)}')
+                with metrics.phase("insert"):
+                    batch_insert_with_dicts(conn, INSERT_QUERY, guard.unique(data))
+            except Exception as e:
+                metrics.record_error()
+                logging.error(f"Error en la página {current_page}: {e}")
+
+        if guard.duplicates:
+            metrics.record_duplicates(guard.duplicates)
+            logging.warning(f"Filas repetidas entre páginas descartadas: {guard.duplicates}")
+
+        profiler.snapshot("export")
+
+    except mysql.connector.Error as err:
+        logging.error(f"Error de conexión a base de datos: {err}")
+    finally:
+        if 'conn' in locals() and conn.is_connected():
+            conn.close()
+
+    profiler.stop()
+    metrics.log_summary()
+    metrics.export()
+    return 0
+
 
-logging.info(f'Tiempo Total: {time.time() - start_time} s')
+if __name__ == "__main__":
+    sys.exit(main())
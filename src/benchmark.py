@@ -0,0 +1,222 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+try:
+    import psutil
+except ImportError:  # psutil es opcional: sólo se usa para el RSS máximo donde no existe os.wait4 (Windows)
+    psutil = None
+
+from mock_server import MockConfig, start_server
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Suite de benchmark: ejecuta cada script contra el mock local y reporta
+# páginas/s, filas/s, RSS máximo y latencia p50/p99 por página.
+#
+#   python src/benchmark.py --rows 50000 --page-size 1000 --latency 20 --output bench.json
+#   python src/benchmark.py --baseline bench.json --tolerance 0.2
+#
+# El RSS máximo se toma de os.wait4 (Linux/macOS). En Windows se muestrea con
+# psutil si está instalado; si no, se reporta como no disponible (null).
+
+SRC_DIR = dirname(abspath(__file__))
+
+# Script -> endpoint del mock que consume
+SCRIPTS = {
+    "app": "indicadores",
+    "app20": "indicadores20",
+    "apprtqc": "quickcount",
+    "funnel": "funnel",
+    "funnelGeneral": "funnelgeneral",
+}
+# app20 requiere MySQL (~/.mysql/prod.conf), por eso no se incluye por defecto
+DEFAULT_SCRIPTS = ["app", "apprtqc", "funnel", "funnelGeneral"]
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_script(script: str, base_url: str, workdir: str, timeout: float):
+    env = {
+        **os.environ,
+        "URL_API_BASE": base_url,
+        "EMAIL_USER": "bench@example.com",
+        "PWD_USER": "bench",
+        "CLIENT_ID": "bench",
+        "SECRET_KEY": "bench",
+        "MARCA": "BENCH",
+    }
+    start = time.perf_counter()
+    # stderr va a un archivo y no a un pipe: el hijo se bloquearía al llenar el buffer del pipe (~64 KB) porque
+    # aquí no se lee hasta que termina
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen([sys.executable, join(SRC_DIR, f"{script}.py")], cwd=workdir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=stderr_file)
+        if hasattr(os, "wait4"):
+            returncode, max_rss = wait_rusage(process, start + timeout)
+        else:
+            returncode, max_rss = wait_sampled(process, start + timeout)
+        wall = time.perf_counter() - start
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode("utf-8", errors="replace")
+    return wall, returncode, max_rss, stderr
+
+
+def wait_rusage(process, deadline: float):
+    """Espera al hijo con os.wait4, que regresa su uso de recursos; regresa (código, RSS máximo en KB)."""
+    while True:
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            break
+        if time.perf_counter() > deadline:
+            process.kill()
+            pid, status, rusage = os.wait4(process.pid, 0)
+            break
+        time.sleep(0.01)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss viene en KB en Linux y en bytes en macOS
+    max_rss = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+    return process.returncode, max_rss
+
+
+def wait_sampled(process, deadline: float):
+    """Espera al hijo muestreando su memoria con psutil; el RSS máximo es None sin psutil."""
+    handle = psutil.Process(process.pid) if psutil is not None else None
+    max_rss = 0 if handle is not None else None
+    while process.poll() is None:
+        if time.perf_counter() > deadline:
+            process.kill()
+            process.wait()
+            break
+        if handle is not None:
+            try:
+                memory = handle.memory_info()
+                # peak_wset (Windows) es el máximo real; rss sólo el valor al momento del muestreo
+                max_rss = max(max_rss, getattr(memory, "peak_wset", memory.rss) // 1024)
+            except psutil.Error:
+                pass
+        time.sleep(0.01)
+    return process.returncode, max_rss
+
+
+def benchmark(scripts, config: MockConfig, timeout: float):
+    server = start_server(config)
+    results = {}
+    try:
+        for script in scripts:
+            endpoint = SCRIPTS[script]
+            server.stats.reset()
+            with tempfile.TemporaryDirectory() as workdir:
+                wall, returncode, max_rss, stderr = run_script(script, server.base_url, workdir, timeout)
+            stats = server.stats.to_dict()
+            pages = stats["pages"].get(endpoint, [])
+            latencies = [page["latency"] for page in pages]
+            rows = sum(page["rows"] for page in pages)
+            results[script] = {
+                "returncode": returncode,
+                "wall_s": round(wall, 4),
+                "pages": len(pages),
+                "rows": rows,
+                "bytes": sum(page["bytes"] for page in pages),
+                "errors": stats["errors"].get(endpoint, 0),
+                "pages_per_s": round(len(pages) / wall, 2) if wall else 0.0,
+                "rows_per_s": round(rows / wall, 2) if wall else 0.0,
+                "max_rss_kb": max_rss,
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            }
+            if returncode != 0:
+                logging.error(f"{script} terminó con código {returncode}: {stderr.strip().splitlines()[-1:]}")
+            r = results[script]
+            rss = f"{r['max_rss_kb']} KB" if r["max_rss_kb"] is not None else "no disponible"
+            logging.info(f"{script}: {r['pages']} páginas, {r['rows']} filas en {r['wall_s']} s | "
+                         f"{r['pages_per_s']} páginas/s, {r['rows_per_s']} filas/s | "
+                         f"RSS máx {rss} | p50 {r['p50_ms']} ms, p99 {r['p99_ms']} ms")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def compare_baseline(results: dict, baseline: dict, tolerance: float):
+    """Regresa la lista de regresiones contra un reporte anterior."""
+    regressions = []
+    for script, current in results.items():
+        previous = baseline.get("results", {}).get(script)
+        if not previous:
+            continue
+        if previous["rows_per_s"] and current["rows_per_s"] < previous["rows_per_s"] * (1 - tolerance):
+            regressions.append(f"{script}: filas/s {current['rows_per_s']} < {previous['rows_per_s']}")
+        if (previous["max_rss_kb"] and current["max_rss_kb"]
+                and current["max_rss_kb"] > previous["max_rss_kb"] * (1 + tolerance)):
+            regressions.append(f"{script}: RSS {current['max_rss_kb']} KB > {previous['max_rss_kb']} KB")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de los scripts contra el mock del API de SICOP")
+    parser.add_argument("--scripts", default=",".join(DEFAULT_SCRIPTS),
+                        help=f"Scripts a medir separados por coma ({','.join(SCRIPTS)})")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia por página en ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variación de la latencia en ms (+/-)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--max-inflight", type=int, default=0, help="Peticiones simultáneas antes de responder 429")
+    parser.add_argument("--no-compression", action="store_true", help="El mock responde sin comprimir")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Proporción de peticiones atoradas (0-1)")
+    parser.add_argument("--stall", type=float, default=0.0, help="Latencia extra de las peticiones atoradas en ms")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Tiempo máximo por script en segundos")
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--baseline", help="Reporte JSON previo contra el cual comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Degradación tolerada contra el baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scripts = [s.strip() for s in args.scripts.split(",") if s.strip()]
+    unknown = [s for s in scripts if s not in SCRIPTS]
+    if unknown:
+        logging.error(f"Scripts desconocidos: {', '.join(unknown)}")
+        return 2
+
+    config = MockConfig(rows=args.rows, page_size=args.page_size, latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate, error_status=args.error_status, max_inflight=args.max_inflight,
+                        compression=not args.no_compression, stall_rate=args.stall_rate, stall=args.stall)
+    results = benchmark(scripts, config, args.timeout)
+    report = {"config": vars(config), "results": results}
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Resultados guardados en {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            logging.error(f"Regresión: {regression}")
+        if regressions:
+            return 1
+
+    return 0 if all(r["returncode"] == 0 for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import importlib
+import inspect
+import json
+import sys
+
+# Punto de entrada único para los scripts y herramientas del repositorio:
+#
+#   python src <comando> [opciones]
+#   python src/cli.py <comando> [opciones]
+#
+# Cada comando importa su módulo sólo cuando se ejecuta, así que la ayuda y
+# --dry-run no cargan aiohttp, requests ni mysql.connector.
+#
+#   python src quickcount --fechaini 20260101 --fechafin 20260118 --dry-run
+#   python src runner jobs.example.json --dry-run
+#   python src mock --rows 50000
+
+# Comando -> módulo de los scripts de consulta (exponen MARCA, ENDPOINT, COMMON_PARAMS y main)
+SCRIPTS = {
+    "indicadores": "app",
+    "indicadores20": "app20",
+    "quickcount": "apprtqc",
+    "funnel": "funnel",
+    "funnelgeneral": "funnelGeneral",
+}
+
+# Comando -> (módulo, descripción) de las herramientas con su propio parse_args; se les pasan los argumentos tal cual
+TOOLS = {
+    "multimarca": ("multimarca", "Un endpoint para varias marcas en un solo proceso"),
+    "runner": ("runner", "Varios trabajos definidos en un archivo JSON"),
+    "poller": ("quickcount_poller", "Consulta periódica de quickcount con detección de cambios"),
+    "query": ("planner", "Consulta que reutiliza datos ya descargados y sólo pide lo que falta"),
+    "benchmark": ("benchmark", "Benchmark de los scripts contra el mock"),
+    "mock": ("mock_server", "Servidor local que simula el API de SICOP"),
+}
+
+
+def script_params(module, args) -> dict:
+    """Parámetros del script con las sobrescrituras de la línea de comandos."""
+    params = {**module.COMMON_PARAMS}
+    if args.fechaini:
+        params["fbyfechaini"] = args.fechaini
+    if args.fechafin:
+        params["fbyfechafin"] = args.fechafin
+    params.update(json.loads(args.params))
+    return params
+
+
+def run_script(command: str, args) -> int:
+    module = importlib.import_module(SCRIPTS[command])
+    marca = args.marca or module.MARCA
+    params = script_params(module, args)
+    if args.dry_run:
+        from sicop import request_plan
+        plan = {"command": command, "module": module.__name__, "request": request_plan(module.ENDPOINT, marca, params)}
+        print(json.dumps(plan, indent=2, ensure_ascii=False))
+        return 0
+    if inspect.iscoroutinefunction(module.main):
+        return asyncio.run(module.main(marca, params))
+    return module.main(marca, params)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="sicop", description="Scripts y herramientas del API de BI de SICOP")
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="comando")
+    for command, module in SCRIPTS.items():
+        sub = subparsers.add_parser(command, help=f"Ejecuta src/{module}.py")
+        sub.add_argument("--marca", help="Marca (por defecto MARCA del .env)")
+        sub.add_argument("--fechaini", help="Fecha inicial AAAAMMDD")
+        sub.add_argument("--fechafin", help="Fecha final AAAAMMDD")
+        sub.add_argument("--params", default="{}", help="Parámetros adicionales en JSON")
+        sub.add_argument("--dry-run", action="store_true", help="Muestra la petición resuelta sin tocar la red")
+    for command, (_, description) in TOOLS.items():
+        subparsers.add_parser(command, help=description, add_help=False)
+    return parser.parse_known_args(argv)
+
+
+def main(argv=None):
+    args, extra = parse_args(argv)
+    if args.command in TOOLS:
+        module = importlib.import_module(TOOLS[args.command][0])
+        return module.main(extra)
+    if extra:
+        print(f"Argumentos no reconocidos: {' '.join(extra)}", file=sys.stderr)
+        return 2
+    return run_script(args.command, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import json
+
+from planner import rollup
+
+# Agrupa trabajos de quickcount que piden los mismos datos con distintos
+# indicadores o gby. En lugar de una descarga completa por trabajo se hace una
+# sola petición por grupo con la unión de los indicadores y de los gby; después
+# cada trabajo recibe sus columnas, agrupadas otra vez a su gby sumando los
+# indicadores (planner.rollup).
+#
+# Se agrupan los trabajos con el mismo endpoint, marca y demás parámetros
+# (fechas, frecuencia, typedate...). La unión de los gby puede regresar más
+# filas que cada consulta por separado, pero evita repetir la descarga.
+
+# Endpoints que reciben indicadores y gby como listas
+COALESCE_ENDPOINTS = ("quickcount",)
+
+
+def ordered_union(lists, reference=()) -> list:
+    """Unión de listas en el orden de reference y después en el orden en que aparecen."""
+    values = [v for values in lists for v in values]
+    result = [v for v in reference if v in values]
+    for value in values:
+        if value not in result:
+            result.append(value)
+    return result
+
+
+class Batch:
+    """Una descarga compartida por uno o más trabajos."""
+
+    def __init__(self, jobs: list):
+        self.jobs = jobs
+        first = jobs[0]
+        self.endpoint = first.endpoint
+        self.marca = first.marca
+        self.priority = min(job.priority for job in jobs)
+        self.name = "+".join(job.name for job in jobs)
+        self.params = dict(first.params)
+        if len(jobs) > 1:
+            defaults = self.endpoint.defaults
+            self.params["indicadores"] = ordered_union([job.params.get("indicadores") or [] for job in jobs],
+                                                       defaults.get("indicadores") or [])
+            self.params["gby"] = ordered_union([job.params.get("gby") or [] for job in jobs],
+                                               defaults.get("gby") or [])
+
+    def rows_for(self, job, rows) -> list:
+        """Filas de la descarga compartida con las columnas y la agrupación que pidió el trabajo."""
+        if len(self.jobs) == 1:
+            return rows
+        stored = {"gby": self.params["gby"], "indicadores": self.params["indicadores"]}
+        requested = {"gby": job.params.get("gby") or [], "indicadores": job.params.get("indicadores") or []}
+        return rollup(self.endpoint, list(rows), stored, requested)
+
+
+def coalesce_key(job):
+    if job.endpoint.name not in COALESCE_ENDPOINTS or job.endpoint.non_additive:
+        return None
+    rest = {k: v for k, v in job.params.items() if k not in ("indicadores", "gby", "page")}
+    return job.endpoint.name, job.marca, json.dumps(rest, sort_keys=True)
+
+
+def coalesce(jobs) -> list:
+    """Agrupa los trabajos compatibles; los demás quedan en un Batch propio."""
+    groups = {}
+    batches = []
+    for job in jobs:
+        key = coalesce_key(job)
+        if key is None:
+            batches.append([job])
+        elif key in groups:
+            groups[key].append(job)
+        else:
+            groups[key] = [job]
+            batches.append(groups[key])
+    return [Batch(group) for group in batches]
@@ -0,0 +1,76 @@
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él sólo se negocia gzip/deflate
+    brotli = None
+
+# Compresión del transporte. Los cuerpos JSON del API repiten las mismas llaves
+# en cada fila y se comprimen muy bien, así que se pide gzip/deflate (y br si
+# está instalado el paquete brotli) y se descomprime por bloques conforme llegan
+# los datos, sin tener el cuerpo comprimido completo en memoria.
+#
+# read_body() regresa los bytes descomprimidos, los bytes recibidos en la red y
+# el tiempo dedicado a descomprimir, para reportarlos por página en RunMetrics.
+
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamDecoder:
+    """Descompresor incremental según Content-Encoding (identity si no viene o no se reconoce)."""
+
+    def __init__(self, encoding: str = None):
+        self.encoding = (encoding or "identity").strip().lower()
+        if self.encoding in ("gzip", "x-gzip"):
+            self.decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == "deflate":
+            self.decoder = zlib.decompressobj()
+        elif self.encoding == "br":
+            if brotli is None:
+                raise ValueError("Respuesta con Content-Encoding br sin el paquete brotli instalado")
+            self.decoder = brotli.Decompressor()
+        else:
+            self.decoder = None
+        self.seconds = 0.0
+
+    def decompress(self, chunk: bytes) -> bytes:
+        if self.decoder is None:
+            return chunk
+        start = time.perf_counter()
+        if self.encoding == "br":
+            data = self.decoder.process(chunk)
+        else:
+            data = self.decoder.decompress(chunk)
+        self.seconds += time.perf_counter() - start
+        return data
+
+    def flush(self) -> bytes:
+        if self.decoder is None or self.encoding == "br":
+            return b""
+        start = time.perf_counter()
+        data = self.decoder.flush()
+        self.seconds += time.perf_counter() - start
+        return data
+
+
+async def read_body(response, chunk_size: int = CHUNK_SIZE):
+    """Lee una respuesta de aiohttp pedida con auto_decompress=False; regresa (cuerpo, bytes en red, segundos)."""
+    decoder = StreamDecoder(response.headers.get("Content-Encoding"))
+    parts = []
+    wire_bytes = 0
+    async for chunk in response.content.iter_chunked(chunk_size):
+        wire_bytes += len(chunk)
+        parts.append(decoder.decompress(chunk))
+    parts.append(decoder.flush())
+    return b"".join(parts), wire_bytes, decoder.seconds
+
+
+def wire_size(response) -> int:
+    """Bytes recibidos en la red (comprimidos) de una respuesta de requests ya leída."""
+    try:
+        return response.raw.tell()
+    except (AttributeError, TypeError):
+        return len(response.content)
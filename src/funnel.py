@@ -1,174 +1,133 @@
 import asyncio
-import time
 import logging
+import sys
 from os import getenv
 
-import aiohttp
-import requests
-from dotenv import load_dotenv
+from hedging import HedgePolicy
+from metrics import RunMetrics
+from profiling import Profiler
+from ratelimit import RateController
+from report import FunnelReport, ReportCache
+from sicop import ENDPOINTS, auth_headers, credentials_from_env, get_access_token, get_env_var
+from sicop import fetch_all_pages as fetch_endpoint_pages
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-load_dotenv()
-
-
-def get_env_var(key: str, default: str = "") -> str:
-    value = getenv(key, default)
-    if not value:
-        print(f"Advertencia: la variable de entorno '{key}' no esta definida. Usando valor por defecto.")
-    return value
-
-
-EMAIL_USER = get_env_var("EMAIL_USER")
-PWD_USER = get_env_var("PWD_USER")
-CLIENT_ID = get_env_var("CLIENT_ID")
-SECRET_KEY = get_env_var("SECRET_KEY")
 MARCA = get_env_var("MARCA")
-
-URL_AUTH_ENDPOINT = "https://api.sicopweb.com/auth/v3/token"
-URL_ENDPOINT_SERVICE = "https://api.sicopweb.com/funnel/prod/indicadores/nacional/detalle"
-
-class UserCredentials:
-
-    def __init__(self, email: str, pwd: str):
-        self.email = email
-        self.pwd = pwd
-
-
-class ClientCredentials:
-
-    def __init__(self, client_id: str, secret_key: str):
-        self.client_id = client_id
-        self.secret_key = secret_key
-
-
-def get_access_token(user_credentials: UserCredentials, client_credentials: ClientCredentials):
-    data = {
-        "email": user_credentials.email,
-        "pwd": user_credentials.pwd,
-        "client_id": client_credentials.client_id,
-        "secret_key": client_credentials.secret_key,
-    }
-    # Encabezados de la solicitud
-    headers = {"Content-type": "application/x-www-form-urlencoded"}
-
-    try:
-        response = requests.post(URL_AUTH_ENDPOINT, data=data, headers=headers)
-        response.raise_for_status()
-        respuesta_json = response.json()
-        token = respuesta_json.get("token")
-        if not token:
-            raise ValueError("Token no presente en la respuesta")
-        return token
-    except Exception as e:
-        logging.error(f"Error al obtener el token de acceso: {e}")
-        return None
-
-
-async def fetch_page(session: aiohttp.ClientSession, headers: dict, params: dict, semaphore: asyncio.Semaphore):
-    async with semaphore:
-        async with session.get(URL_ENDPOINT_SERVICE, headers=headers, params=params) as response:
-            response.raise_for_status()
-            current_page = int(response.headers.get("x-sicop-api-current-page", params.get("page", 1)))
-            total_pages = int(response.headers.get("x-sicop-api-pages", 1))
-            data = await response.json()
-            logging.info(f"Pagina: {current_page} de {total_pages}, Total Items: {len(data)}")
-            return current_page, total_pages, data
-
-
-async def fetch_all_pages(headers: dict, common_params: dict, max_concurrency: int = 5):
+# Tope de peticiones simultáneas; el control adaptativo decide cuántas usar por debajo de él
+MAX_CONCURRENCY = int(getenv("MAX_CONCURRENCY") or 20)
+
+ENDPOINT = ENDPOINTS["funnel"]
+
+# Parámetros de la consulta; la marca se agrega como "origen" al armar la petición
+PARAMS_CAC = {
+    "fbyfechaini": "20260101",
+    "fbyfechafin": "20260114",
+    "fbyatiende": "CAC",
+}
+PARAMS_DEALER = {
+    "fbyfechaini": "20260101",
+    "fbyfechafin": "20260114",
+    "fbyatiende": "DEALER",
+}
+PARAMS_TOTAL = {
+    "fbyfechaini": "20251202",
+    "fbyfechafin": "20260102",
+}
+
+COMMON_PARAMS = PARAMS_TOTAL
+
+
+async def fetch_all_pages(headers: dict, common_params: dict, max_concurrency: int = 20, metrics: RunMetrics = None,
+                          initial_concurrency: int = 5, marca: str = None, hedge: HedgePolicy = None):
+    """La concurrencia arranca en initial_concurrency y se ajusta (AIMD) hasta max_concurrency.
+
+    Cada página tiene un timeout de PAGE_TIMEOUT segundos y, con hedge (por defecto HedgePolicy.from_env()), las
+    páginas más lentas que el percentil HEDGE_PERCENTILE se piden dos veces dentro de HEDGE_BUDGET.
+    """
+    import aiohttp
+    metrics = metrics or RunMetrics("funnel")
     semaphore = asyncio.Semaphore(max_concurrency)
+    rate = RateController(initial=initial_concurrency, maximum=max_concurrency)
+    hedge = hedge or HedgePolicy.from_env()
     async with aiohttp.ClientSession() as session:
-        first_params = {**common_params, "page": 1}
-        first_page, total_pages, first_data = await fetch_page(session, headers, first_params, semaphore)
-        results = {first_page: first_data}
-
-        if total_pages > 1:
-            tasks = []
-            for page in range(2, total_pages + 1):
-                params = {**common_params, "page": page}
-                tasks.append(asyncio.create_task(fetch_page(session, headers, params, semaphore)))
+        return await fetch_endpoint_pages(session, ENDPOINT, marca or MARCA, headers, common_params, semaphore,
+                                          metrics, rate, hedge=hedge)
 
-            for task in asyncio.as_completed(tasks):
-                page, _, data = await task
-                results[page] = data
 
-        fulldata = []
-        for page in sorted(results.keys()):
-            fulldata.extend(results[page])
+def log_totals(totals: dict):
+    logging.info(f'Prospectos: {totals["prospectos"]["total"]}')
+    logging.info(f'ProspectosDigitales: {totals["prospectos"]["leads"]}')
+    logging.info(f'ProspectosInactivos: {totals["prospectosinactivos"]["total"]}')
+    logging.info(f"Ventas: {totals['ventasentregadas']['total']}")
+    logging.info(f"VentasDigitales: {totals['ventasentregadasleads']['total']}")
 
-        return fulldata, total_pages
 
+async def main(marca: str = None, params: dict = None):
+    import aiohttp
+    marca = marca or MARCA
+    metrics = RunMetrics("funnel", {"marca": marca})
+    profiler = Profiler.from_env("funnel").start()
+    common_params = {**COMMON_PARAMS, **(params or {})}
 
-async def main():
-    start_time = time.time()
+    # Con REPORT_DIR se reutiliza el reporte de una corrida anterior con los mismos parámetros
+    cache = ReportCache.from_env()
+    summary = cache.load(ENDPOINT.name, marca, common_params)
+    if summary is not None:
+        log_totals(summary["totals"])
+        profiler.stop()
+        metrics.log_summary()
+        metrics.export()
+        return 0
 
-    user = UserCredentials(email=EMAIL_USER, pwd=PWD_USER)
-    client = ClientCredentials(client_id=CLIENT_ID, secret_key=SECRET_KEY)
+    user, client = credentials_from_env()
 
     logging.info('Get Access Token...')
-    token = get_access_token(user, client)
+    with metrics.phase("auth"):
+        token = get_access_token(user, client)
 
     if not token:
-        return
-
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {token}",
-    }
-
-    params_cac = {
-        "origen": MARCA,
-        "fbyfechaini": "20260101",
-        "fbyfechafin": "20260114",
-        "fbyatiende": "CAC",
-    }
-    params_dealer = {
-        "origen": MARCA,
-        "fbyfechaini": "20260101",
-        "fbyfechafin": "20260114",
-        "fbyatiende": "DEALER",
-    }
-    params_total = {
-        "origen": MARCA,
-        "fbyfechaini": "20251202",
-        "fbyfechafin": "20260102",
-    }
-
-    common_params = params_total
+        profiler.stop()
+        return 1
+
+    headers = auth_headers(token)
 
     logging.info('Request data...')
     try:
-        fulldata, total_pages = await fetch_all_pages(headers, common_params, max_concurrency=5)
-    except (aiohttp.ClientError, asyncio.CancelledError) as e:
+        # La fase download es tiempo de reloj; network y decode suman el tiempo de cada página concurrente
+        with metrics.phase("download"):
+            fulldata, total_pages = await fetch_all_pages(headers, common_params, max_concurrency=MAX_CONCURRENCY,
+                                                          metrics=metrics, marca=marca)
+    except (aiohttp.ClientError, asyncio.CancelledError, ValueError) as e:
+        metrics.record_error()
         logging.error(f"Error al obtener datos: {e}")
-        return
+        profiler.stop()
+        metrics.log_summary()
+        metrics.export()
+        return 1
 
     logging.info(f"Total Items: {len(fulldata)}")
-
-    # Calculamos total de prospectos acumulados en fulldata
-    total_prospectos = 0
-    total_prospectos_digitales = 0
-    total_prospectos_inactivos = 0
-    total_ventas = 0
-    total_ventas_digitales = 0
-
-    for row in fulldata:
-        total_prospectos += int(row['prospectos'])
-        total_prospectos_digitales += int(row['leads'])
-        total_prospectos_inactivos += float(row['prospectosinactivos'])
-        total_ventas += int(row["ventasentregadas"])
-        total_ventas_digitales += int(row["ventasentregadasleads"])
-
-    logging.info(f'Prospectos: {total_prospectos}')
-    logging.info(f'ProspectosDigitales: {total_prospectos_digitales}')
-    logging.info(f'ProspectosInactivos: {total_prospectos_inactivos}')
-    logging.info(f"Ventas: {total_ventas}")
-    logging.info(f"VentasDigitales: {total_ventas_digitales}")
-
-    total_time = time.time() - start_time
-    logging.info(f'Tiempo Total: {total_time} s')
+    profiler.snapshot("download")
+
+    # Totales por indicador y canal (y por REPORT_DIMENSION si se indica)
+    report = FunnelReport(cache.dimension)
+    with metrics.phase("aggregation"):
+        report.extend(fulldata)
+    profiler.snapshot("aggregation")
+
+    summary = report.to_dict(ENDPOINT.name, marca, common_params)
+    # Con páginas perdidas los totales están incompletos y no deben reutilizarse
+    if metrics.errors:
+        logging.warning(f"Reporte no guardado: {metrics.errors} páginas con error")
+    else:
+        cache.save(ENDPOINT.name, marca, common_params, summary)
+    log_totals(summary["totals"])
+
+    profiler.stop()
+    metrics.log_summary()
+    metrics.export()
+    return 0
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    sys.exit(asyncio.run(main()))
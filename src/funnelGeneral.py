@@ -1,242 +1,80 @@
-import requests
-import time
 import logging
-from os import getenv
-from dotenv import load_dotenv
+import sys
+
+from compression import wire_size
+from metrics import RunMetrics
+from profiling import Profiler
+from report import FunnelReport, ReportCache
+from sicop import (ENDPOINTS, auth_headers, credentials_from_env, get_access_token, get_env_var,
+                   request_with_retry)
+from snapshot import SnapshotGuard
+from spill import SpillBuffer
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-load_dotenv()
-
-def get_env_var(key: str, default: str = "") -> str:
-    value = getenv(key, default)
-    if not value:
-        print(f"Warning: Environment variable '{key}' is not defined. Setting default value")
-    return value
-
-EMAIL_USER = get_env_var("EMAIL_USER")
-PWD_USER   = get_env_var("PWD_USER")
-CLIENT_ID  = get_env_var("CLIENT_ID")
-SECRET_KEY = get_env_var("SECRET_KEY")
-MARCA      = get_env_var("MARCA")
-
-URL_AUTH_ENDPOINT = "https://api.sicopweb.com/auth/v3/token"
-URL_ENDPOINT_SERVICE = f"https://api.sicopweb.com/funnel/v8/indicadores/nacional/detalle/general"
-
-class UserCredentials:
-
-    def __init__(self, email: str, pwd: str):
-        self.email = email
-        self.pwd = pwd
-
-class ClientCredentials:
-    
-    def __init__(self, client_id: str, secret_key: str):
-        self.client_id = client_id
-        self.secret_key = secret_key
-
-def get_access_token(userCredentials: UserCredentials, clientCredentials: ClientCredentials):
-    # Credenciales de acceso
-    data = {
-        'email': userCredentials.email,
-        'pwd': userCredentials.pwd,
-        'client_id': clientCredentials.client_id,
-        'secret_key': clientCredentials.secret_key
-    }
-    # Encabezados de la solicitud
-    headers = {"Content-type": "application/x-www-form-urlencoded"}
-
-    try:
-        response = requests.post(URL_AUTH_ENDPOINT, data=data, headers=headers)
-        response.raise_for_status()
-        respuesta_json = response.json()
-        token = respuesta_json.get("token")
-        if not token:
-            raise ValueError("Token no presente en la respuesta")
-        return token
-    except Exception as e:
-        logging.error(f"Error al obtener el token de acceso: {e}")
-        return None
-
-def get_data(params, headers):
-    response = requests.request('GET', URL_ENDPOINT_SERVICE, headers=headers, params=params)
-    response.raise_for_status()
-    return response
-
-start_time = time.time()
-
-user = UserCredentials(email=EMAIL_USER,pwd=PWD_USER)
-client = ClientCredentials(client_id=CLIENT_ID,secret_key=SECRET_KEY)
-logging.info('Get Access Token...')
-# Obtenemos el token de acceso
-token = get_access_token(user, client)
+MARCA = get_env_var("MARCA")
 
-if not token:
-    exit(1)
+ENDPOINT = ENDPOINTS["funnelgeneral"]
 
-# Encabezados necesarios con token de acceso
-headers = {
-  'Content-Type': 'application/json',
-  'Authorization': f'Bearer {token}'
+# Parámetros de la consulta (la marca va en 'origen'); main() acepta sobrescribirlos
+COMMON_PARAMS = {
+    'fbyfechaini':'20260301',
+    'fbyfechafin':'20260323'
 }
 
-try:
-    # Primer peticion para obtener datos
-    current_page = 1
-    common_params = {
-        'origen':MARCA,
-        'fbyfechaini':'20260301', 
-        'fbyfechafin':'20260323'
-    }
-    params = {**common_params, "page": current_page}
-
-    fulldata = []
-    total_pages = 0
-    current_page = 0
-    response = None
-    total_records = 0
-
-    logging.info('Request data...')
-    response = get_data(params, headers)
-    total_pages = int(response.headers.get('x-sicop-api-pages', 1))
-    current_page = int(response.headers.get('x-sicop-api-current-page', 1))
-
-    #Parseamos el resultado
-    data = response.json()
-    if not isinstance(data, list):
-        raise ValueError("Unexpected response: response not is dictionary")
-    
-    total_records = len(data)
-    fulldata.extend(data)
-
-    #Solo imprimir el total de elementos descargados en la iteraccion
-    logging.info(f'Page: {current_page} of {total_pages}, Total records: {total_records}')
-
-    # Recorrido para obtener resto de paginas
-    while(current_page < total_pages):
-        current_page = current_page + 1
-        params = {**common_params, "page": current_page}
-        try:
-            response = get_data(params, headers)
-            current_page = int(response.headers.get('x-sicop-api-current-page', current_page))
-            #Parseamos el resultado
-            data = response.json()
-            if not isinstance(data, list):
-                raise ValueError("Unexpected response in pages iterations")
-            total_records = len(data)
-            #Solo imprimir el total de elementos descargados en la iteraccion
-            logging.info(f'Page: {current_page} de {total_pages}, Total records: {total_records}')
-            fulldata.extend(data)
-        except Exception as e:
-            logging.error(f"Error in page {current_page}: {e}")
-
-    logging.info(f'Total records: {len(fulldata)}')
-
-    # Calculamos total de prospectos acumulados en fulldata
-    total_leads = 0
-    total_valid = 0
-    total_shows = 0
-    total_test_drive = 0
-    total_quotes = 0
-    total_sales = 0
-    total_delivery = 0
-
-    total_digital_leads = 0
-    total_walkin_leads = 0
-    total_street_leads = 0
-    total_database_leads = 0
-
-    total_digital_valid = 0
-    total_walkin_valid = 0
-    total_street_valid = 0
-    total_database_valid = 0
-
-    total_quotes = 0
-    total_quotes_walkin = 0
-    total_quotes_street = 0
-    total_quotes_db = 0
-    total_quotes_digital = 0
-
-    total_quotes_unique = 0
-    total_quotes_walkin_unique = 0
-    total_quotes_street_unique = 0
-    total_quotes_db_unique = 0
-    total_quotes_digital_unique = 0
-
-    total_inactive = 0.0
-    total_digital_inactive = 0.0
-    total_walkin_inactive = 0.0
-    total_street_inactive = 0.0
-    total_database_inactive = 0.0
-
-    intentados = 0.0
-    intentados_minutos = 0.0
-
-    total_apartados = 0
-    total_digital_apartados = 0
-    total_walkin_apartados = 0
-    total_street_apartados = 0
-    total_database_apartados = 0
-
-    total_citas = 0
-    total_digital_citas = 0
-    total_walkin_citas = 0
-    total_street_citas = 0
-    total_database_citas = 0
-
-    for row in fulldata:
-        total_leads += row['prospectos']
-        total_valid += row['asignados']
-        total_shows += row['shows']
-        total_test_drive += row['prospectoscondemo']
-        total_quotes += row['prospectosconcotizacion']
-        total_sales += row['ventasfacturadas']
-        total_delivery += row['ventasentregadas']
-
-        total_walkin_leads += row['prospectospiso']
-        total_street_leads += row['prospectoscalle']
-        total_database_leads += row['prospectoscartera']
-        total_digital_leads += row['leads']
-
-        total_walkin_valid += row['asignadospiso']
-        total_street_valid += row['asignadoscalle']
-        total_database_valid += row['asignadoscartera']
-        total_digital_valid += row['asignadosleads']
-
-        total_quotes += row['cotizaciones']
-        total_quotes_walkin += row['cotizacionespiso']
-        total_quotes_street += row['cotizacionescalle']
-        total_quotes_db += row['cotizacionescartera']
-        total_quotes_digital += row['cotizacionesleads']
-
-        total_quotes_unique += row['prospectosconcotizacion']
-        total_quotes_walkin_unique += row['prospectosconcotizacionpiso']
-        total_quotes_street_unique += row['prospectosconcotizacioncalle']
-        total_quotes_db_unique += row['prospectosconcotizacioncartera']
-        total_quotes_digital_unique += row['prospectosconcotizacionleads']
-
-        total_inactive += float(row['prospectosinactivos'])
-        total_walkin_inactive += float(row['prospectosinactivospiso'])
-        total_street_inactive += float(row['prospectosinactivoscalle'])
-        total_database_inactive += float(row['prospectosinactivoscartera'])
-        total_digital_inactive += float(row['prospectosinactivosleads'])
-
-        intentados += float(row['intentados'])
-        if(row['intentadosminutos'] ):
-            intentados_minutos += float(row['intentadosminutos'])
-
-        total_apartados += row['apartados']
-        total_walkin_apartados += row['apartadospiso']
-        total_street_apartados += row['apartadoscalle']
-        total_database_apartados += row['apartadoscartera']
-        total_digital_apartados += row['apartadosleads']
-
-        total_citas += row['citas']
-        total_walkin_citas += row['citaspiso']
-        total_street_citas += row['citascalle']
-        total_database_citas += row['citascartera']
-        total_digital_citas += row['citasleads']
+def get_data(url, params, headers, metrics=None):
+    return request_with_retry('GET', url, metrics, headers=headers, params=params)
+
+def log_totals(totals):
+    total_leads = totals['prospectos']['total']
+    total_valid = totals['asignados']['total']
+    total_shows = totals['shows']['total']
+    total_test_drive = totals['prospectoscondemo']['total']
+    total_quotes = totals['prospectosconcotizacion']['total'] + totals['cotizaciones']['total']
+    total_sales = totals['ventasfacturadas']['total']
+    total_delivery = totals['ventasentregadas']['total']
+
+    total_digital_leads = totals['prospectos']['leads']
+    total_walkin_leads = totals['prospectos']['piso']
+    total_street_leads = totals['prospectos']['calle']
+    total_database_leads = totals['prospectos']['cartera']
+
+    total_digital_valid = totals['asignados']['leads']
+    total_walkin_valid = totals['asignados']['piso']
+    total_street_valid = totals['asignados']['calle']
+
+    total_quotes_walkin = totals['cotizaciones']['piso']
+    total_quotes_street = totals['cotizaciones']['calle']
+    total_quotes_db = totals['cotizaciones']['cartera']
+    total_quotes_digital = totals['cotizaciones']['leads']
+
+    total_quotes_unique = totals['prospectosconcotizacion']['total']
+    total_quotes_walkin_unique = totals['prospectosconcotizacion']['piso']
+    total_quotes_street_unique = totals['prospectosconcotizacion']['calle']
+    total_quotes_db_unique = totals['prospectosconcotizacion']['cartera']
+    total_quotes_digital_unique = totals['prospectosconcotizacion']['leads']
+
+    total_inactive = totals['prospectosinactivos']['total']
+    total_digital_inactive = totals['prospectosinactivos']['leads']
+    total_walkin_inactive = totals['prospectosinactivos']['piso']
+    total_street_inactive = totals['prospectosinactivos']['calle']
+    total_database_inactive = totals['prospectosinactivos']['cartera']
+
+    intentados = float(totals['intentados']['total'])
+    intentados_minutos = float(totals['intentadosminutos']['total'])
+
+    total_apartados = totals['apartados']['total']
+    total_digital_apartados = totals['apartados']['leads']
+    total_walkin_apartados = totals['apartados']['piso']
+    total_street_apartados = totals['apartados']['calle']
+    total_database_apartados = totals['apartados']['cartera']
+
+    total_citas = totals['citas']['total']
+    total_digital_citas = totals['citas']['leads']
+    total_walkin_citas = totals['citas']['piso']
+    total_street_citas = totals['citas']['calle']
+    total_database_citas = totals['citas']['cartera']
 
     logging.info(f'===== DOWNLOAD INFO =====')
     logging.info(f'Total Leads: {total_leads}')
@@ -284,7 +122,8 @@ try:
     logging.info(f'===== Intentados =====')
     logging.info(f'Intentados: {intentados}')
     logging.info(f'Intentados minutos: {intentados_minutos}')
-    logging.info(f'Tiempo: {intentados_minutos/intentados}')
+    # Una ventana sin intentados (p. ej. un día sin actividad) no tiene tiempo promedio
+    logging.info(f'Tiempo: {intentados_minutos/intentados if intentados else "n/a"}')
 
     logging.info(f'===== Apartados =====')
     logging.info(f'Total Apartados: {total_apartados}')
@@ -300,7 +139,137 @@ try:
     logging.info(f'Total Database Citas: {total_database_citas}')
     logging.info(f'Total Digital Citas: {total_digital_citas}')
 
-except Exception as e:
-    logging.error(f"General Error: {e}")
+def main(marca: str = None, params: dict = None):
+    marca = marca or MARCA
+    metrics = RunMetrics("funnelGeneral", {"marca": marca})
+    profiler = Profiler.from_env("funnelGeneral").start()
+    url = ENDPOINT.url(marca)
+    common_params = {'origen': marca, **COMMON_PARAMS, **(params or {})}
+
+    # Con REPORT_DIR se reutiliza el reporte de una corrida anterior con los mismos parámetros
+    cache = ReportCache.from_env()
+    try:
+        cached = cache.load(ENDPOINT.name, marca, common_params)
+        if cached is not None:
+            log_totals(cached["totals"])
+    except Exception as e:
+        cached = None
+        logging.error(f"General Error: {e}")
+    if cached is not None:
+        profiler.stop()
+        metrics.log_summary()
+        metrics.export()
+        return 0
+
+    user, client = credentials_from_env()
+    logging.info('Get Access Token...')
+    # Obtenemos el token de acceso
+    with metrics.phase("auth"):
+        token = get_access_token(user, client)
+
+    if not token:
+        profiler.stop()
+        return 1
+
+    # Encabezados necesarios con token de acceso
+    headers = auth_headers(token)
+
+    try:
+        # Primer peticion para obtener datos
+        current_page = 1
+        params =  {**common_params, "page": current_page}
+
+        # Con MEMORY_BUDGET_ROWS las páginas pasan a disco al rebasar el presupuesto
+        fulldata = SpillBuffer.from_env()
+        total_pages = 0
+        current_page = 0
+        response = None
+        total_records = 0
+
+        logging.info('Request data...')
+        with metrics.phase("network") as page_timer:
+            response = get_data(url, params, headers, metrics)
+        total_pages = int(response.headers.get('x-sicop-api-pages', 1))
+        guard = SnapshotGuard(total_pages)
+        current_page = int(response.headers.get('x-sicop-api-current-page', 1))
+
+        #Parseamos el resultado
+        with metrics.phase("decode") as decode_timer:
+            data = response.json()
+        if not isinstance(data, list):
+            raise ValueError("Unexpected response: response not is dictionary")
+        metrics.record_page(page_timer.elapsed, len(response.content), len(data), wire_size(response),
+                            decode_timer.elapsed)
+    
+        total_records = len(data)
+        fulldata.extend(guard.unique(data))
+
+        #Solo imprimir el total de elementos descargados en la iteraccion
+        logging.info(f'Page: {current_page} of {total_pages}, Total records: {total_records}')
+
+        # Recorrido para obtener resto de paginas
+        while(current_page < total_pages):
+            current_page = current_page + 1
+            params = {**common_params, "page": current_page}
+            try:
+                with metrics.phase("network") as page_timer:
+                    response = get_data(url, params, headers, metrics)
+                total_pages, restart = guard.check(response)
+                if restart:
+                    # El conjunto cambió: se descarta lo acumulado y se vuelve a la primera página
+                    metrics.record_refetch(current_page - 1)
+                    fulldata.clear()
+                    current_page = 0
+                    continue
+                current_page = int(response.headers.get('x-sicop-api-current-page', current_page))
+                #Parseamos el resultado
+                with metrics.phase("decode") as decode_timer:
+                    data = response.json()
+                if not isinstance(data, list):
+                    raise ValueError("Unexpected response in pages iterations")
+                metrics.record_page(page_timer.elapsed, len(response.content), len(data), wire_size(response),
+                                    decode_timer.elapsed)
+                total_records = len(data)
+                #Solo imprimir el total de elementos descargados en la iteraccion
+                logging.info(f'Page: {current_page} de {total_pages}, Total records: {total_records}')
+                fulldata.extend(guard.unique(data))
+            except Exception as e:
+                metrics.record_error()
+                logging.error(f"Error in page {current_page}: {e}")
+
+        if guard.duplicates:
+            metrics.record_duplicates(guard.duplicates)
+            logging.warning(f"Duplicate rows across pages dropped: {guard.duplicates}")
+
+        logging.info(f'Total records: {len(fulldata)}')
+        fulldata.log_summary()
+        profiler.snapshot("download")
+
+        # Totales por indicador y canal (y por REPORT_DIMENSION si se indica)
+        report = FunnelReport(cache.dimension)
+        with metrics.phase("aggregation"):
+            report.extend(fulldata)
+        profiler.snapshot("aggregation")
+
+        summary = report.to_dict(ENDPOINT.name, marca, common_params)
+        # Con páginas perdidas los totales están incompletos y no deben reutilizarse
+        if metrics.errors:
+            logging.warning(f"Report not saved: {metrics.errors} pages failed")
+        else:
+            cache.save(ENDPOINT.name, marca, common_params, summary)
+        log_totals(summary["totals"])
+
+    except Exception as e:
+        logging.error(f"General Error: {e}")
+    finally:
+        if 'fulldata' in locals():
+            fulldata.close()
+
+    profiler.stop()
+    metrics.log_summary()
+    metrics.export()
+    return 0
+
 
-logging.info(f'Total time: {time.time() - start_time} s')
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import asyncio
+from collections import deque
+from os import getenv
+
+# Peticiones duplicadas (hedging) para las páginas lentas. En una descarga
+# concurrente la corrida termina cuando llega la página más lenta, así que una
+# sola página atorada alarga todo el tiempo total.
+#
+# HedgePolicy lleva las latencias de las páginas que ya llegaron. Si una página
+# tarda más que el percentil HEDGE_PERCENTILE de esas latencias, se manda la
+# misma petición otra vez y se usa la respuesta que llegue primero; la otra se
+# cancela. Las duplicadas se limitan a HEDGE_BUDGET (fracción de las peticiones)
+# para no aumentar la carga sobre el API más de eso, y no se duplica nada hasta
+# tener HEDGE_MIN_SAMPLES latencias. HEDGE_BUDGET=0 desactiva el hedging.
+
+
+class HedgePolicy:
+
+    def __init__(self, percentile: float = 95.0, budget: float = 0.05, min_samples: int = 20,
+                 min_delay: float = 0.05, window: int = 500):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+
+    @classmethod
+    def from_env(cls):
+        """Política según HEDGE_PERCENTILE, HEDGE_BUDGET y HEDGE_MIN_SAMPLES; None si HEDGE_BUDGET es 0."""
+        policy = cls(percentile=float(getenv("HEDGE_PERCENTILE") or 95),
+                     budget=float(getenv("HEDGE_BUDGET") or 0.05),
+                     min_samples=int(getenv("HEDGE_MIN_SAMPLES") or 20))
+        return policy if policy.budget > 0 else None
+
+    def observe(self, latency: float):
+        self.latencies.append(latency)
+
+    def delay(self) -> float:
+        """Segundos de espera antes de duplicar una petición; None mientras no haya suficientes muestras."""
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(self.percentile / 100 * (len(ordered) - 1))))
+        return max(self.min_delay, ordered[index])
+
+    def allow(self) -> bool:
+        return self.hedges < self.budget * self.requests
+
+    async def run(self, request, metrics=None):
+        """Ejecuta request() y, si tarda más que delay(), una copia; regresa el primer resultado sin error.
+
+        request es una función sin argumentos que regresa un coroutine nuevo en cada llamada.
+        """
+        self.requests += 1
+        delay = self.delay()
+        primary = asyncio.ensure_future(request())
+        if delay is None:
+            return await primary
+        backup = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self.allow():
+                return await primary
+            self.hedges += 1
+            if metrics is not None:
+                metrics.record_hedge()
+            backup = asyncio.ensure_future(request())
+            pending = {primary, backup}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.wins += 1
+                            if metrics is not None:
+                                metrics.record_hedge_win()
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # La petición que no ganó se cancela (cierra su conexión)
+            for task in (primary, backup):
+                if task is not None and not task.done():
+                    task.cancel()
@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from os import getenv
+from os.path import join
+
+# Instrumentación de las corridas: duración por fase (auth, network, decode,
+# aggregation, insert, export...), histograma de latencia por página, bytes
+# descomprimidos y recibidos en la red, tiempo de decodificación por página,
+# filas/s, reintentos, timeouts y peticiones duplicadas (hedging). Al final
+# se exporta un reporte JSON y un textfile de Prometheus (formato del textfile
+# collector de node_exporter) en el directorio indicado por METRICS_DIR.
+
+# Cotas superiores (segundos) del histograma de latencia por página
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+class PhaseTimer:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+
+def escape_label(value) -> str:
+    """Valor de etiqueta con \\, " y saltos de línea escapados según el formato de texto de Prometheus."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+
+    def __init__(self, script: str, labels: dict = None):
+        self.script = script
+        self.labels = labels or {}
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.end = None
+        self.phases = {}
+        self.page_latencies = []
+        self.page_decode = []
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.pages = 0
+        self.rows = 0
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.retries = 0
+        self.errors = 0
+        self.duplicates = 0
+        self.refetches = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @contextmanager
+    def phase(self, name: str):
+        """Mide un bloque y lo acumula en la fase indicada. Las fases concurrentes suman tiempo ocupado."""
+        timer = PhaseTimer()
+        try:
+            yield timer
+        finally:
+            timer.elapsed = time.perf_counter() - timer.start
+            self.add_phase(name, timer.elapsed)
+
+    def add_phase(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def record_page(self, latency: float, size: int, rows: int, wire_size: int = None, decode: float = None):
+        """size son los bytes descomprimidos y wire_size los recibidos en la red (igual a size si no se indica)."""
+        self.pages += 1
+        self.rows += rows
+        self.bytes += size
+        self.wire_bytes += size if wire_size is None else wire_size
+        self.page_latencies.append(latency)
+        if decode is not None:
+            self.page_decode.append(decode)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.bucket_counts[index] += 1
+                break
+        else:
+            self.bucket_counts[-1] += 1
+
+    def merge(self, other: "RunMetrics"):
+        """Suma los contadores y latencias de otra corrida (p. ej. una marca dentro de una corrida multimarca)."""
+        self.pages += other.pages
+        self.rows += other.rows
+        self.bytes += other.bytes
+        self.wire_bytes += other.wire_bytes
+        self.retries += other.retries
+        self.errors += other.errors
+        self.duplicates += other.duplicates
+        self.refetches += other.refetches
+        self.timeouts += other.timeouts
+        self.hedges += other.hedges
+        self.hedge_wins += other.hedge_wins
+        self.page_latencies.extend(other.page_latencies)
+        self.page_decode.extend(other.page_decode)
+        self.bucket_counts = [a + b for a, b in zip(self.bucket_counts, other.bucket_counts)]
+        for name, seconds in other.phases.items():
+            if name not in ("auth", "download"):
+                self.add_phase(name, seconds)
+
+    def record_retry(self):
+        self.retries += 1
+
+    def record_error(self):
+        self.errors += 1
+
+    def record_duplicates(self, count: int):
+        self.duplicates += count
+
+    def record_refetch(self, pages: int = 1):
+        self.refetches += pages
+
+    def record_timeout(self):
+        self.timeouts += 1
+
+    def record_hedge(self):
+        self.hedges += 1
+
+    def record_hedge_win(self):
+        self.hedge_wins += 1
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+        return self
+
+    @property
+    def total(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def percentile(self, p: float, values=None) -> float:
+        """Percentil de la latencia por página (o de los valores indicados)."""
+        values = self.page_latencies if values is None else values
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def report(self) -> dict:
+        total = self.total
+        return {
+            "script": self.script,
+            "labels": self.labels,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "total_seconds": round(total, 4),
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "pages": self.pages,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "wire_bytes": self.wire_bytes,
+            "compression_ratio": round(self.bytes / self.wire_bytes, 2) if self.wire_bytes else 0.0,
+            "retries": self.retries,
+            "errors": self.errors,
+            "duplicates": self.duplicates,
+            "refetches": self.refetches,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "rows_per_second": round(self.rows / total, 2) if total else 0.0,
+            "page_latency": {
+                "p50": round(self.percentile(50), 4),
+                "p90": round(self.percentile(90), 4),
+                "p99": round(self.percentile(99), 4),
+                "max": round(max(self.page_latencies, default=0.0), 4),
+                "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], self.bucket_counts)),
+            },
+            "page_decode": {
+                "p50": round(self.percentile(50, self.page_decode), 4),
+                "p99": round(self.percentile(99, self.page_decode), 4),
+                "max": round(max(self.page_decode, default=0.0), 4),
+            },
+        }
+
+    def prometheus(self) -> str:
+        labels = {"script": self.script, **self.labels}
+
+        def fmt(extra: dict = None) -> str:
+            merged = {**labels, **(extra or {})}
+            return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in merged.items()) + "}"
+
+        total = self.total
+        lines = [
+            "# HELP sicop_run_duration_seconds Duración total de la corrida.",
+            "# TYPE sicop_run_duration_seconds gauge",
+            f"sicop_run_duration_seconds{fmt()} {total:.6f}",
+            "# HELP sicop_run_timestamp_seconds Momento de inicio de la corrida.",
+            "# TYPE sicop_run_timestamp_seconds gauge",
+            f"sicop_run_timestamp_seconds{fmt()} {self.started_at.timestamp():.0f}",
+            "# HELP sicop_phase_duration_seconds Duración acumulada por fase.",
+            "# TYPE sicop_phase_duration_seconds gauge",
+        ]
+        for name, seconds in self.phases.items():
+            lines.append(f"sicop_phase_duration_seconds{fmt({'phase': name})} {seconds:.6f}")
+        for metric, value, help_text in [
+            ("sicop_pages_total", self.pages, "Páginas descargadas."),
+            ("sicop_rows_total", self.rows, "Filas descargadas."),
+            ("sicop_bytes_total", self.bytes, "Bytes recibidos (descomprimidos)."),
+            ("sicop_wire_bytes_total", self.wire_bytes, "Bytes recibidos en la red (comprimidos)."),
+            ("sicop_retries_total", self.retries, "Reintentos de peticiones."),
+            ("sicop_errors_total", self.errors, "Páginas con error."),
+            ("sicop_duplicate_rows_total", self.duplicates, "Filas repetidas entre páginas descartadas."),
+            ("sicop_refetched_pages_total", self.refetches, "Páginas pedidas de nuevo por cambio del total."),
+            ("sicop_timeouts_total", self.timeouts, "Peticiones que rebasaron el timeout por página."),
+            ("sicop_hedged_requests_total", self.hedges, "Peticiones duplicadas por latencia alta."),
+            ("sicop_hedge_wins_total", self.hedge_wins, "Peticiones duplicadas que llegaron antes que la original."),
+        ]:
+            # Contadores de la corrida: el archivo se reescribe en cada corrida, lo que Prometheus trata como reinicio
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter", f"{metric}{fmt()} {value}"]
+        lines += [
+            "# HELP sicop_rows_per_second Filas por segundo de la corrida.",
+            "# TYPE sicop_rows_per_second gauge",
+            f"sicop_rows_per_second{fmt()} {(self.rows / total if total else 0.0):.2f}",
+            "# HELP sicop_page_latency_seconds Latencia por página.",
+            "# TYPE sicop_page_latency_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], self.bucket_counts):
+            cumulative += count
+            lines.append(f"sicop_page_latency_seconds_bucket{fmt({'le': bound})} {cumulative}")
+        lines.append(f"sicop_page_latency_seconds_sum{fmt()} {sum(self.page_latencies):.6f}")
+        lines.append(f"sicop_page_latency_seconds_count{fmt()} {self.pages}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, directory: str = None):
+        """Escribe el reporte JSON y el textfile de Prometheus; sin directorio no se exporta nada."""
+        directory = directory if directory is not None else getenv("METRICS_DIR", "")
+        if not directory:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        suffix = "_".join([self.script] + [str(v) for v in self.labels.values()])
+        report_file = join(directory, f"{suffix}_{self.started_at.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+        # Escritura atómica para que el collector nunca lea un archivo a medias
+        prom_file = join(directory, f"{suffix}.prom")
+        with open(prom_file + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(prom_file + ".tmp", prom_file)
+        logging.info(f"Métricas exportadas: {report_file}, {prom_file}")
+        return report_file
+
+    def log_summary(self):
+        report = self.finish().report()
+        latency = report["page_latency"]
+        decode = report["page_decode"]
+        for name, seconds in report["phases"].items():
+            logging.info(f"Fase {name}: {seconds} s")
+        logging.info(f"Páginas: {report['pages']}, Filas: {report['rows']}, Bytes: {report['bytes']} "
+                     f"(en red: {report['wire_bytes']}, compresión {report['compression_ratio']}x), "
+                     f"Reintentos: {report['retries']}, Errores: {report['errors']}")
+        if report["duplicates"] or report["refetches"]:
+            logging.info(f"Filas repetidas descartadas: {report['duplicates']}, "
+                         f"Páginas pedidas de nuevo: {report['refetches']}")
+        if report["timeouts"] or report["hedges"]:
+            logging.info(f"Timeouts: {report['timeouts']}, Peticiones duplicadas: {report['hedges']} "
+                         f"({report['hedge_wins']} llegaron primero)")
+        logging.info(f"Latencia por página p50: {latency['p50']} s, p99: {latency['p99']} s, "
+                     f"Decodificación por página p50: {decode['p50']} s, Filas/s: {report['rows_per_second']}")
+        logging.info(f"Tiempo Total: {report['total_seconds']} s")
@@ -0,0 +1,441 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Servidor local que imita al API de SICOP (autenticación y endpoints paginados)
+# para medir los scripts sin depender de api.sicopweb.com.
+#
+#   python src/mock_server.py --port 8080 --rows 20000 --page-size 1000 --latency 50
+#
+# y en el .env de los scripts:
+#
+#   URL_API_BASE = 'http://127.0.0.1:8080'
+
+MOCK_TOKEN = "mock-sicop-token"
+
+DIMENSIONES = ["zona", "region", "plaza", "distribuidor", "auto", "fuenteinformacion", "subcampana"]
+CANALES = ["piso", "calle", "cartera", "leads"]
+
+
+class MockConfig:
+
+    def __init__(self, rows: int = 5000, page_size: int = 500, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 500, seed: int = 0, churn: float = 0.0,
+                 churn_period: float = 10.0, max_inflight: int = 0, compression: bool = True, growth: float = 0.0,
+                 stall_rate: float = 0.0, stall: float = 0.0):
+        self.rows = rows
+        self.page_size = page_size
+        # Latencia y jitter en milisegundos
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.seed = seed
+        # Proporción de páginas que cambian de contenido en cada periodo (segundos)
+        self.churn = churn
+        self.churn_period = churn_period
+        # Peticiones simultáneas antes de responder 429 (0 = sin límite)
+        self.max_inflight = max_inflight
+        # Comprimir (gzip/deflate) cuando el cliente lo acepta en Accept-Encoding
+        self.compression = compression
+        # Filas nuevas por segundo que se insertan al inicio y recorren las demás a páginas posteriores
+        self.growth = growth
+        # Proporción de peticiones que se atoran y milisegundos extra que tardan (cola larga de latencia)
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.started = time.monotonic()
+
+    def growth_offset(self) -> int:
+        return int((time.monotonic() - self.started) * self.growth) if self.growth else 0
+
+    def total_pages(self, offset: int = 0) -> int:
+        return max(1, math.ceil((self.rows + offset) / self.page_size))
+
+
+class MockStats:
+    """Registro de las peticiones atendidas por endpoint (latencia, filas y bytes por página)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.errors = {}
+        self.auth_requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def record_page(self, endpoint: str, page: int, latency: float, rows: int, size: int):
+        with self.lock:
+            self.pages.setdefault(endpoint, []).append({
+                "page": page, "latency": latency, "rows": rows, "bytes": size
+            })
+
+    def record_error(self, endpoint: str):
+        with self.lock:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def enter(self) -> int:
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return self.in_flight
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def record_auth(self):
+        with self.lock:
+            self.auth_requests += 1
+
+    def reset(self):
+        with self.lock:
+            self.pages = {}
+            self.errors = {}
+            self.auth_requests = 0
+            self.max_in_flight = 0
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "auth_requests": self.auth_requests,
+                "pages": {k: list(v) for k, v in self.pages.items()},
+                "errors": dict(self.errors),
+                "max_in_flight": self.max_in_flight,
+            }
+
+
+def parse_fecha(value, default: date) -> date:
+    try:
+        return datetime.strptime(str(value), "%Y%m%d").date()
+    except (TypeError, ValueError):
+        return default
+
+
+# Las dimensiones y la fecha dependen sólo del índice de la fila para que la
+# llave de cada fila sea estable aunque cambien sus indicadores.
+def fecha_row(index: int, params: dict) -> date:
+    rng = random.Random(f"fecha:{index}")
+    fecha_ini = parse_fecha(params.get("fbyfechaini"), date(2026, 3, 1))
+    fecha_fin = parse_fecha(params.get("fbyfechafin"), fecha_ini)
+    dias = max(0, (fecha_fin - fecha_ini).days)
+    return fecha_ini + timedelta(days=rng.randint(0, dias))
+
+
+def dimensiones_row(index: int) -> dict:
+    rng = random.Random(f"dimensiones:{index}")
+    return {
+        "zona": f"ZONA {index % 5 + 1}",
+        "region": f"REGION {index % 12 + 1}",
+        "plaza": f"PLAZA {index % 40 + 1}",
+        "distribuidor": f"D{index % 200 + 1:04d}",
+        "auto": f"AUTO {rng.randint(1, 30)}",
+        "fuenteinformacion": f"FUENTE {rng.randint(1, 15)}",
+        "subcampana": f"SUBCAMPANA {rng.randint(1, 50)}",
+    }
+
+
+def indicadores_row(rng: random.Random, index: int, params: dict) -> dict:
+    fecha = fecha_row(index, params)
+    row = {"anio": fecha.year, "mes": fecha.month, "dia": fecha.day, **dimensiones_row(index)}
+    row["prospectospiso"] = rng.randint(0, 20)
+    row["leads"] = rng.randint(0, 40)
+    row["prospectos"] = row["prospectospiso"] + row["leads"] + rng.randint(0, 10)
+    return row
+
+
+def indicadores20_row(rng: random.Random, index: int, params: dict) -> dict:
+    fecha = fecha_row(index, params)
+    intentados = rng.randint(0, 30)
+    intentados_minutos = rng.randint(0, 600)
+    return {
+        "anio": fecha.year, "mes": fecha.month, "dia": fecha.day, "fecha": fecha.isoformat(),
+        "codigomarca": params.get("marca", ""),
+        **dimensiones_row(index),
+        "idejecutivo": rng.randint(1, 5000),
+        "ejecutivo": f"EJECUTIVO {rng.randint(1, 5000)}",
+        "recibidos": rng.randint(0, 40),
+        "intentados": intentados,
+        "intentadosminutos": intentados_minutos,
+        "tiempopromediointentados": round(intentados_minutos / intentados, 2) if intentados else 0,
+        "contactados": rng.randint(0, 30),
+        "asignados": rng.randint(0, 30),
+        "citas": rng.randint(0, 10),
+        "citasregistradas": rng.randint(0, 10),
+        "show": rng.randint(0, 8),
+        "confirmaciondecitas": rng.randint(0, 8),
+        "ventas": rng.randint(0, 5),
+        "ventasfacturadas": rng.randint(0, 5),
+    }
+
+
+def funnel_row(rng: random.Random, index: int, params: dict) -> dict:
+    row = {"origen": params.get("origen", ""), **dimensiones_row(index)}
+    for indicador in ["prospectos", "asignados", "cotizaciones", "prospectosconcotizacion", "apartados", "citas"]:
+        total = 0
+        for canal in CANALES:
+            valor = rng.randint(0, 10)
+            row[f"{indicador}{canal}"] = valor
+            total += valor
+        row[indicador] = total
+    # En el API los totales de leads no llevan sufijo en "prospectos"
+    row["leads"] = row.pop("prospectosleads")
+    row["prospectosinactivos"] = 0.0
+    for canal in CANALES:
+        valor = float(rng.randint(0, 3))
+        row[f"prospectosinactivos{canal}"] = valor
+        row["prospectosinactivos"] += valor
+    row["shows"] = rng.randint(0, 10)
+    row["prospectoscondemo"] = rng.randint(0, 10)
+    row["ventasfacturadas"] = rng.randint(0, 5)
+    row["ventasentregadas"] = rng.randint(0, 5)
+    row["ventasentregadasleads"] = rng.randint(0, row["ventasentregadas"])
+    row["intentados"] = float(rng.randint(1, 30))
+    row["intentadosminutos"] = float(rng.randint(0, 600)) if rng.random() > 0.1 else None
+    return row
+
+
+def quickcount_row(rng: random.Random, index: int, params: dict) -> dict:
+    fecha = fecha_row(index, params)
+    row = {"anio": fecha.year, "mes": fecha.month, "dia": fecha.day, **dimensiones_row(index)}
+    row["fuente"] = row.pop("fuenteinformacion")
+    for indicador in params.get("indicadores") or []:
+        row[indicador] = rng.randint(0, 20)
+    row["prospectosnuevos"] = rng.randint(0, 20)
+    row["prospectosmodificados"] = rng.randint(0, 20)
+    row["citas"] = rng.randint(0, 10)
+    return row
+
+
+# Forma de cada endpoint: (nombre, método, patrón de ruta, generador de filas, respuesta en sobre "data")
+ENDPOINTS = [
+    ("indicadores", "POST", re.compile(r"^/bi/prod/indicadores/(?P<marca>[^/]+)/nacional$"), indicadores_row, False),
+    ("indicadores20", "POST", re.compile(r"^/bi/prod/indicadores20/(?P<marca>[^/]+)/nacional$"), indicadores20_row, False),
+    ("funnel", "GET", re.compile(r"^/funnel/prod/indicadores/nacional/detalle$"), funnel_row, False),
+    ("funnelgeneral", "GET", re.compile(r"^/funnel/v8/indicadores/nacional/detalle/general$"), funnel_row, False),
+    ("quickcount", "POST", re.compile(r"^/bi/qa/rt/quickcount/(?P<marca>[^/]+)$"), quickcount_row, True),
+]
+
+
+def build_page(config: MockConfig, endpoint: str, row_factory, params: dict, page: int, offset: int = 0):
+    start = (page - 1) * config.page_size
+    end = min(config.rows + offset, start + config.page_size)
+    if offset:
+        # Las filas nuevas van primero (la más reciente al inicio) y cada fila conserva su contenido
+        # aunque cambie de página, como en el API cuando entran registros durante la descarga
+        rows = []
+        for position in range(start, end):
+            index = config.rows + offset - 1 - position if position < offset else position - offset
+            rows.append(row_factory(random.Random(f"{config.seed}:{endpoint}:fila:{index}"), index, params))
+        return rows
+    epoch = 0
+    if config.churn:
+        current = int(time.time() // config.churn_period)
+        if random.Random(f"{endpoint}:{page}:{current}").random() < config.churn:
+            epoch = current
+    rng = random.Random(f"{config.seed}:{endpoint}:{page}:{epoch}")
+    return [row_factory(rng, index, params) for index in range(start, end)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        return self.rfile.read(length) if length else b""
+
+    def encode_payload(self, payload: bytes):
+        """Comprime según Accept-Encoding; regresa (bytes, Content-Encoding o None)."""
+        if not self.server.config.compression:
+            return payload, None
+        accepted = [e.split(";")[0].strip().lower() for e in self.headers.get("Accept-Encoding", "").split(",")]
+        if "gzip" in accepted:
+            return gzip.compress(payload, compresslevel=6, mtime=0), "gzip"
+        if "deflate" in accepted:
+            return zlib.compress(payload, 6), "deflate"
+        return payload, None
+
+    def send_json(self, status: int, body, extra_headers: dict = None) -> int:
+        """Envía el JSON y regresa los bytes enviados (comprimidos si aplica)."""
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        payload, encoding = self.encode_payload(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(payload)
+        return len(payload)
+
+    def handle_request(self, method: str):
+        start = time.perf_counter()
+        config: MockConfig = self.server.config
+        stats: MockStats = self.server.stats
+        url = urlparse(self.path)
+        raw_body = self.read_body()
+
+        if url.path == "/auth/v3/token" and method == "POST":
+            stats.record_auth()
+            self.send_json(200, {"token": MOCK_TOKEN})
+            return
+        if url.path == "/__stats":
+            self.send_json(200, stats.to_dict())
+            return
+
+        for name, endpoint_method, pattern, row_factory, envelope in ENDPOINTS:
+            match = pattern.match(url.path)
+            if match and endpoint_method == method:
+                break
+        else:
+            self.send_json(404, {"error": f"Ruta no encontrada: {method} {url.path}"})
+            return
+
+        if self.headers.get("Authorization") != f"Bearer {MOCK_TOKEN}":
+            self.send_json(401, {"error": "Token inválido"})
+            return
+
+        if method == "GET":
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        else:
+            try:
+                params = json.loads(raw_body or b"{}")
+            except ValueError:
+                self.send_json(400, {"error": "Cuerpo JSON inválido"})
+                return
+        params = {**params, **match.groupdict()}
+
+        in_flight = stats.enter()
+        try:
+            self.serve_page(config, stats, name, row_factory, envelope, params, in_flight, start)
+        finally:
+            stats.leave()
+
+    def serve_page(self, config: MockConfig, stats: MockStats, name: str, row_factory, envelope: bool, params: dict,
+                   in_flight: int, start: float):
+        if config.max_inflight and in_flight > config.max_inflight:
+            stats.record_error(name)
+            self.send_json(429, {"error": "Demasiadas peticiones"}, {"Retry-After": 1})
+            return
+
+        # Latencia simulada con jitter
+        delay = config.latency + random.uniform(-config.jitter, config.jitter)
+        if config.stall_rate and random.random() < config.stall_rate:
+            delay += config.stall
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        if config.error_rate and random.random() < config.error_rate:
+            stats.record_error(name)
+            extra = {"Retry-After": 1} if config.error_status in (429, 503) else None
+            self.send_json(config.error_status, {"error": "Error simulado"}, extra)
+            return
+
+        offset = config.growth_offset()
+        total_pages = config.total_pages(offset)
+        page = min(max(1, int(params.get("page", 1) or 1)), total_pages)
+        rows = build_page(config, name, row_factory, params, page, offset)
+        body = {"data": rows} if envelope else rows
+        payload = json.dumps(body).encode("utf-8")
+        etag = f'"{hashlib.sha1(payload).hexdigest()}"'
+        pagination = {"x-sicop-api-pages": total_pages, "x-sicop-api-current-page": page, "ETag": etag}
+        if self.headers.get("If-None-Match") == etag:
+            # Petición condicional sin cambios: sólo encabezados
+            self.send_response(304)
+            for key, value in pagination.items():
+                self.send_header(key, str(value))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            stats.record_page(name, page, time.perf_counter() - start, 0, 0)
+            return
+        size = self.send_json(200, payload, pagination)
+        stats.record_page(name, page, time.perf_counter() - start, len(rows), size)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: MockConfig):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.stats = MockStats()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0):
+    """Levanta el servidor en un hilo y regresa la instancia (port=0 elige un puerto libre)."""
+    server = MockServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor local que simula el API de SICOP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--rows", type=int, default=5000, help="Total de filas por consulta")
+    parser.add_argument("--page-size", type=int, default=500, help="Filas por página")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia por página en ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variación de la latencia en ms (+/-)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Proporción de páginas con error (0-1)")
+    parser.add_argument("--error-status", type=int, default=500, help="Código HTTP de los errores simulados")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--churn", type=float, default=0.0, help="Proporción de páginas que cambian por periodo (0-1)")
+    parser.add_argument("--max-inflight", type=int, default=0, help="Peticiones simultáneas antes de responder 429")
+    parser.add_argument("--churn-period", type=float, default=10.0, help="Duración del periodo de cambios en segundos")
+    parser.add_argument("--growth", type=float, default=0.0,
+                        help="Filas nuevas por segundo insertadas al inicio (recorren las páginas)")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Proporción de peticiones atoradas (0-1)")
+    parser.add_argument("--stall", type=float, default=0.0, help="Latencia extra de las peticiones atoradas en ms")
+    parser.add_argument("--no-compression", action="store_true", help="No comprimir aunque el cliente lo acepte")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = MockConfig(rows=args.rows, page_size=args.page_size, latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate, error_status=args.error_status, seed=args.seed,
+                        churn=args.churn, churn_period=args.churn_period, max_inflight=args.max_inflight,
+                        compression=not args.no_compression, growth=args.growth, stall_rate=args.stall_rate,
+                        stall=args.stall)
+    server = MockServer((args.host, args.port), config)
+    logging.info(f'Mock API en {server.base_url} ({config.rows} filas, {config.total_pages()} páginas)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
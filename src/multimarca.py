@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+from os import getenv
+from os.path import join
+
+from metrics import RunMetrics
+from ratelimit import RateController
+from sicop import ENDPOINTS, auth_headers, credentials_from_env, fetch_all_pages, get_access_token, request_plan
+from sinks import export_to_csv
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Descarga de un endpoint para varias marcas en un solo proceso: un solo token,
+# una sola sesión HTTP y un límite global de peticiones concurrentes repartido
+# entre todas las marcas. Cada marca genera su propio CSV.
+#
+#   python src/multimarca.py --marcas MARCA1,MARCA2,MARCA3 --endpoint quickcount --max-concurrency 10
+
+
+async def download_marca(session, endpoint, marca: str, headers: dict, params: dict,
+                         semaphore: asyncio.Semaphore, rate: RateController, output_dir: str):
+    import aiohttp
+    metrics = RunMetrics("multimarca", {"endpoint": endpoint.name, "marca": marca})
+    try:
+        with metrics.phase("download"):
+            fulldata, total_pages = await fetch_all_pages(session, endpoint, marca, headers, params,
+                                                          semaphore, metrics, rate)
+    except (aiohttp.ClientError, ValueError) as e:
+        metrics.record_error()
+        logging.error(f"Error al obtener datos de {marca}: {e}")
+        metrics.finish()
+        metrics.export()
+        return marca, None
+
+    logging.info(f"{marca}: {len(fulldata)} registros en {total_pages} páginas")
+    fecha_actual = datetime.now().strftime("%Y-%m-%d")
+    filename = join(output_dir, f"{fecha_actual}_{endpoint.name}_{marca}_{params.get('fbyfechaini', '')}_"
+                                f"{params.get('fbyfechafin', '')}.csv")
+    with metrics.phase("export"):
+        export_to_csv(fulldata, filename)
+    metrics.finish()
+    metrics.export()
+    return marca, metrics
+
+
+async def run(marcas, endpoint_name: str, params: dict, max_concurrency: int, output_dir: str):
+    import aiohttp
+    metrics = RunMetrics("multimarca", {"endpoint": endpoint_name})
+    endpoint = ENDPOINTS[endpoint_name]
+
+    user, client = credentials_from_env()
+    logging.info('Get Access Token...')
+    with metrics.phase("auth"):
+        token = get_access_token(user, client)
+    if not token:
+        return 1
+
+    headers = auth_headers(token)
+    os.makedirs(output_dir, exist_ok=True)
+    # Un solo semáforo, un solo control adaptativo y un solo pool de conexiones para todas las marcas
+    semaphore = asyncio.Semaphore(max_concurrency)
+    rate = RateController(initial=min(5, max_concurrency), maximum=max_concurrency)
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        with metrics.phase("download"):
+            results = await asyncio.gather(*[
+                download_marca(session, endpoint, marca, headers, params, semaphore, rate, output_dir)
+                for marca in marcas
+            ])
+
+    failed = [marca for marca, marca_metrics in results if marca_metrics is None]
+    for _, marca_metrics in results:
+        if marca_metrics is not None:
+            metrics.merge(marca_metrics)
+    metrics.errors += len(failed)
+    if failed:
+        logging.error(f"Marcas con error: {', '.join(failed)}")
+    metrics.log_summary()
+    metrics.export()
+    return 1 if failed else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Descarga de un endpoint del API de SICOP para varias marcas")
+    parser.add_argument("--marcas", default=getenv("MARCAS") or getenv("MARCA", ""),
+                        help="Marcas separadas por coma (por defecto MARCAS o MARCA del .env)")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="indicadores")
+    parser.add_argument("--fechaini", required=True, help="Fecha inicial AAAAMMDD")
+    parser.add_argument("--fechafin", required=True, help="Fecha final AAAAMMDD")
+    parser.add_argument("--params", default="{}", help="Parámetros adicionales en JSON")
+    parser.add_argument("--max-concurrency", type=int, default=10, help="Peticiones simultáneas entre todas las marcas")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra las peticiones resueltas sin tocar la red")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    marcas = [m.strip() for m in args.marcas.split(",") if m.strip()]
+    if not marcas:
+        logging.error("No se indicaron marcas (--marcas o MARCAS)")
+        return 2
+    params = {
+        **ENDPOINTS[args.endpoint].defaults,
+        "fbyfechaini": args.fechaini,
+        "fbyfechafin": args.fechafin,
+        **json.loads(args.params),
+    }
+    if args.dry_run:
+        plan = [request_plan(ENDPOINTS[args.endpoint], marca, params) for marca in marcas]
+        print(json.dumps({"max_concurrency": args.max_concurrency, "requests": plan}, indent=2, ensure_ascii=False))
+        return 0
+    return asyncio.run(run(marcas, args.endpoint, params, args.max_concurrency, args.output_dir))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
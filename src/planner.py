@@ -0,0 +1,462 @@
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from os import getenv
+from os.path import exists, join
+
+from metrics import RunMetrics
+from ratelimit import RateController
+from report import number
+from sicop import ENDPOINTS, Endpoint, auth_headers, credentials_from_env, fetch_all_pages, get_access_token
+from sinks import write_sink
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Planeador de consultas: antes de ir al API revisa qué parte de la consulta se
+# puede responder con datos descargados antes y sólo pide lo que falta.
+#
+# - Cada descarga se guarda en LOCAL_STORE_DIR como un "dataset" por endpoint,
+#   marca, frecuencia, gby, indicadores y demás parámetros, partido en rebanadas
+#   de fechas (JSONL comprimido con gzip).
+# - En endpoints con anio/mes/dia y frecuencia DIARIA la consulta se resuelve día
+#   por día: se usa un dataset con el mismo gby o uno más fino (más dimensiones,
+#   se vuelve a agrupar sumando los indicadores) y con los mismos indicadores o
+#   más. Los días que ninguno cubre se piden al API en rangos contiguos.
+# - En los demás (funnel o frecuencias no diarias) sólo se reutiliza una
+#   rebanada con exactamente la misma ventana de fechas.
+# - Los días más recientes (LOCAL_STORE_FRESH_DAYS, 1 por defecto: hoy y ayer)
+#   siempre se piden al API porque todavía pueden cambiar. Lo mismo vale para lo
+#   guardado: de cada rebanada sólo se reutilizan los días que ya eran
+#   definitivos cuando se descargó, y no se guardan rangos con páginas perdidas.
+#
+#   python src/planner.py --endpoint indicadores --fechaini 20260101 --fechafin 20260131 --gby zona,region
+#   python src/planner.py --endpoint indicadores --fechaini 20260101 --fechafin 20260131 --explain
+
+DATE_FIELDS = ("anio", "mes", "dia", "fecha")
+# Parámetros que definen la ventana de la consulta y no la identidad del dataset
+WINDOW_PARAMS = ("fbyfechaini", "fbyfechafin", "page")
+
+
+def as_list(value) -> list:
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(",") if v.strip()]
+    return list(value)
+
+
+def parse_day(value: str) -> date:
+    return datetime.strptime(str(value), "%Y%m%d").date()
+
+
+def days_between(ini: str, fin: str) -> list:
+    start, end = parse_day(ini), parse_day(fin)
+    return [(start + timedelta(days=n)).strftime("%Y%m%d") for n in range((end - start).days + 1)]
+
+
+def row_day(row: dict) -> str:
+    return f"{int(row['anio']):04d}{int(row['mes']):02d}{int(row['dia']):02d}"
+
+
+def identity(endpoint: Endpoint, marca: str, params: dict) -> dict:
+    """Lo que distingue a un dataset: todo menos la ventana de fechas y la página."""
+    rest = {k: v for k, v in params.items() if k not in WINDOW_PARAMS + ("gby", "indicadores", "frecuencia")}
+    return {
+        "endpoint": endpoint.name,
+        "marca": marca,
+        "frecuencia": params.get("frecuencia", ""),
+        "gby": as_list(params.get("gby")),
+        "indicadores": as_list(params.get("indicadores")),
+        "params": rest,
+    }
+
+
+class Dataset:
+
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+
+    @property
+    def identity(self) -> dict:
+        return self.meta["identity"]
+
+    @property
+    def slices(self) -> list:
+        return self.meta["slices"]
+
+    @staticmethod
+    def final_before(item: dict, fresh_days: int) -> str:
+        """Primer día que todavía podía cambiar cuando se descargó la rebanada."""
+        fetched = parse_day(item["fetched_at"][:8])
+        return (fetched - timedelta(days=fresh_days)).strftime("%Y%m%d")
+
+    def covered_days(self, fresh_days: int) -> dict:
+        """Día -> rebanada más reciente que lo cubre, sólo con los días que ya eran definitivos al descargarla."""
+        covered = {}
+        for index, item in enumerate(self.slices):
+            final_before = self.final_before(item, fresh_days)
+            for day in days_between(item["ini"], min(item["fin"], final_before)):
+                if day < final_before:
+                    covered[day] = index
+        return covered
+
+    def read_slice(self, index: int):
+        with gzip.open(join(self.path, self.slices[index]["file"]), "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def read_days(self, days: set, fresh_days: int) -> list:
+        covered = self.covered_days(fresh_days)
+        by_slice = {}
+        for day in days:
+            by_slice.setdefault(covered[day], set()).add(day)
+        rows = []
+        for index, wanted in sorted(by_slice.items()):
+            rows.extend(row for row in self.read_slice(index) if row_day(row) in wanted)
+        return rows
+
+    def window_slice(self, ini: str, fin: str, fresh_days: int) -> int:
+        """Índice de la rebanada más reciente con exactamente esa ventana (endpoints sin fechas por fila).
+
+        Sólo sirve si toda la ventana ya era definitiva cuando se descargó. Se decide con el índice, sin leer
+        la rebanada; None si no hay.
+        """
+        for index in range(len(self.slices) - 1, -1, -1):
+            item = self.slices[index]
+            if item["ini"] == ini and item["fin"] == fin and fin < self.final_before(item, fresh_days):
+                return index
+        return None
+
+    def read_window(self, ini: str, fin: str, fresh_days: int) -> list:
+        index = self.window_slice(ini, fin, fresh_days)
+        return list(self.read_slice(index)) if index is not None else None
+
+    def add_slice(self, ini: str, fin: str, rows: list):
+        fetched_at = datetime.now().strftime("%Y%m%d%H%M%S")
+        filename = f"{ini}_{fin}_{fetched_at}.jsonl.gz"
+        with gzip.open(join(self.path, filename), "wt", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False))
+                f.write("\n")
+        self.slices.append({"ini": ini, "fin": fin, "file": filename, "rows": len(rows), "fetched_at": fetched_at})
+        self.save()
+
+    def save(self):
+        # Escritura atómica para no dejar el índice a medias si se interrumpe
+        meta_file = join(self.path, "meta.json")
+        with open(meta_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2, ensure_ascii=False)
+        os.replace(meta_file + ".tmp", meta_file)
+
+
+class LocalStore:
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @classmethod
+    def from_env(cls):
+        return cls(getenv("LOCAL_STORE_DIR") or ".sicop_store")
+
+    def datasets(self, endpoint: str, marca: str) -> list:
+        base = join(self.directory, endpoint)
+        if not exists(base):
+            return []
+        result = []
+        for name in sorted(os.listdir(base)):
+            meta_file = join(base, name, "meta.json")
+            if not exists(meta_file):
+                continue
+            with open(meta_file, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["identity"]["marca"] == marca:
+                result.append(Dataset(join(base, name), meta))
+        return result
+
+    def dataset(self, key: dict) -> Dataset:
+        """Dataset con esa identidad; se crea vacío si no existe."""
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        path = join(self.directory, key["endpoint"], digest)
+        meta_file = join(path, "meta.json")
+        if exists(meta_file):
+            with open(meta_file, encoding="utf-8") as f:
+                return Dataset(path, json.load(f))
+        os.makedirs(path, exist_ok=True)
+        return Dataset(path, {"identity": key, "slices": []})
+
+
+class Step:
+    """Parte de una consulta: días que se leen de un dataset local o rango que se pide al API."""
+
+    def __init__(self, source: str, ini: str, fin: str, dataset: Dataset = None, days: list = None):
+        self.source = source
+        self.ini = ini
+        self.fin = fin
+        self.dataset = dataset
+        self.days = days or []
+
+    def describe(self) -> dict:
+        step = {"source": self.source, "fbyfechaini": self.ini, "fbyfechafin": self.fin}
+        if self.dataset is not None:
+            step["dataset"] = self.dataset.path
+            step["gby"] = self.dataset.identity["gby"]
+        return step
+
+
+class QueryPlanner:
+
+    def __init__(self, store: LocalStore, fresh_days: int = 1):
+        self.store = store
+        self.fresh_days = fresh_days
+
+    def usable(self, endpoint: Endpoint, dataset: Dataset, key: dict, exact: bool) -> bool:
+        stored = dataset.identity
+        if (stored["frecuencia"], stored["params"]) != (key["frecuencia"], key["params"]):
+            return False
+        if exact:
+            return stored["gby"] == key["gby"] and stored["indicadores"] == key["indicadores"]
+        if not set(key["indicadores"]) <= set(stored["indicadores"]) or not set(key["gby"]) <= set(stored["gby"]):
+            return False
+        # Con más dimensiones guardadas hay que volver a agrupar, y eso sólo se puede sumando
+        return set(stored["gby"]) == set(key["gby"]) or not endpoint.non_additive
+
+    def plan(self, endpoint: Endpoint, marca: str, params: dict) -> list:
+        key = identity(endpoint, marca, params)
+        ini, fin = params["fbyfechaini"], params["fbyfechafin"]
+        datasets = self.store.datasets(endpoint.name, marca)
+
+        if not endpoint.dated or key["frecuencia"] != "DIARIA":
+            for dataset in datasets:
+                if (self.usable(endpoint, dataset, key, exact=True)
+                        and dataset.window_slice(ini, fin, self.fresh_days) is not None):
+                    return [Step("local", ini, fin, dataset)]
+            return [Step("remote", ini, fin)]
+
+        # Preferir el mismo gby y, si no, el más cercano (menos filas que volver a agrupar)
+        candidates = [d for d in datasets if self.usable(endpoint, d, key, exact=False)]
+        candidates.sort(key=lambda d: (len(d.identity["gby"]), len(d.identity["indicadores"])))
+        coverage = [(dataset, dataset.covered_days(self.fresh_days)) for dataset in candidates]
+
+        steps = []
+        for day in days_between(ini, fin):
+            source = next((dataset for dataset, covered in coverage if day in covered), None)
+            previous = steps[-1] if steps else None
+            if previous is not None and previous.dataset is source:
+                previous.fin = day
+                previous.days.append(day)
+            elif source is None:
+                steps.append(Step("remote", day, day, days=[day]))
+            else:
+                steps.append(Step("local", day, day, source, [day]))
+        return steps
+
+    def read_local(self, endpoint: Endpoint, step: Step, key: dict) -> list:
+        if not endpoint.dated or key["frecuencia"] != "DIARIA":
+            rows = step.dataset.read_window(step.ini, step.fin, self.fresh_days)
+        else:
+            rows = step.dataset.read_days(set(step.days), self.fresh_days)
+        return rollup(endpoint, rows, step.dataset.identity, key)
+
+    async def execute(self, session, endpoint: Endpoint, marca: str, headers: dict, params: dict, steps: list,
+                      semaphore: asyncio.Semaphore, metrics: RunMetrics, rate: RateController = None,
+                      save: bool = True) -> list:
+        key = identity(endpoint, marca, params)
+        remote = [step for step in steps if step.source == "remote"]
+
+        async def fetch(step: Step):
+            # Métricas por rango para saber si alguno perdió páginas
+            step_metrics = RunMetrics("planner")
+            step_params = {**params, "fbyfechaini": step.ini, "fbyfechafin": step.fin}
+            try:
+                rows, _ = await fetch_all_pages(session, endpoint, marca, headers, step_params, semaphore,
+                                                step_metrics, rate)
+            finally:
+                metrics.merge(step_metrics)
+            return rows, step_metrics.errors
+
+        with metrics.phase("download"):
+            fetched = await asyncio.gather(*[fetch(step) for step in remote])
+        remote_rows = {id(step): rows for step, (rows, _) in zip(remote, fetched)}
+
+        if save and remote:
+            dataset = self.store.dataset(key)
+            for step, (rows, errors) in zip(remote, fetched):
+                # Un rango con páginas perdidas respondería consultas futuras con datos incompletos
+                if errors:
+                    logging.warning(f"{step.ini}-{step.fin} no se guarda: {errors} páginas con error")
+                    continue
+                dataset.add_slice(step.ini, step.fin, rows)
+
+        result = []
+        with metrics.phase("local"):
+            for step in steps:
+                if step.source == "remote":
+                    result.extend(remote_rows[id(step)])
+                else:
+                    result.extend(self.read_local(endpoint, step, key))
+        return result
+
+
+def is_number(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    if value is None or isinstance(value, (int, float)):
+        return True
+    if isinstance(value, str):
+        try:
+            number(value)
+            return True
+        except ValueError:
+            return False
+    return False
+
+
+def as_number(value):
+    if value is None:
+        return 0
+    return number(value) if isinstance(value, str) else value
+
+
+def rollup(endpoint: Endpoint, rows: list, stored: dict, key: dict) -> list:
+    """Lleva filas de un dataset más fino al gby e indicadores pedidos."""
+    extra_indicadores = set(stored["indicadores"]) - set(key["indicadores"]) - set(endpoint.base_indicadores)
+    extra_gby = [g for g in stored["gby"] if g not in key["gby"]]
+    if not extra_gby:
+        if not extra_indicadores:
+            return rows
+        return [{k: v for k, v in row.items() if k not in extra_indicadores} for row in rows]
+
+    dropped = set(extra_indicadores)
+    for dimension in extra_gby:
+        dropped.update(endpoint.dimension_fields.get(dimension, [dimension]))
+    dimensions = set(DATE_FIELDS)
+    for dimension in key["gby"]:
+        dimensions.update(endpoint.dimension_fields.get(dimension, [dimension]))
+
+    # Los campos que se suman se deciden por nombre: los indicadores pedidos más los que el endpoint siempre
+    # regresa. Sin lista de indicadores (indicadores, indicadores20), los campos que no son dimensión y siempre
+    # traen un número (el API puede mandarlos como texto). Los demás forman la llave del grupo.
+    if key["indicadores"]:
+        summed = (set(key["indicadores"]) | set(endpoint.base_indicadores)) - dimensions - dropped
+    else:
+        fields = {k for row in rows for k in row} - dimensions - dropped
+        summed = {k for k in fields if all(is_number(row.get(k)) for row in rows)}
+
+    groups = {}
+    for row in rows:
+        values = {k: v for k, v in row.items() if k not in dropped}
+        group_key = tuple((k, v) for k, v in values.items() if k not in summed)
+        group = groups.get(group_key)
+        if group is None:
+            groups[group_key] = {k: as_number(v) if k in summed else v for k, v in values.items()}
+            continue
+        for k in summed:
+            if k in values:
+                group[k] = as_number(group.get(k)) + as_number(values[k])
+    return list(groups.values())
+
+
+async def run(planner: QueryPlanner, endpoint: Endpoint, marca: str, params: dict, steps: list, sink: dict,
+              max_concurrency: int, save: bool):
+    import aiohttp
+    metrics = RunMetrics("planner", {"endpoint": endpoint.name, "marca": marca})
+    headers = {}
+    if any(step.source == "remote" for step in steps):
+        user, client = credentials_from_env()
+        logging.info('Get Access Token...')
+        with metrics.phase("auth"):
+            token = get_access_token(user, client)
+        if not token:
+            return 1
+        headers = auth_headers(token)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    rate = RateController(initial=min(5, max_concurrency), maximum=max_concurrency)
+    try:
+        async with aiohttp.ClientSession() as session:
+            rows = await planner.execute(session, endpoint, marca, headers, params, steps, semaphore, metrics,
+                                         rate, save)
+    except (aiohttp.ClientError, ValueError) as e:
+        metrics.record_error()
+        logging.error(f"Error al obtener datos: {e}")
+        metrics.log_summary()
+        metrics.export()
+        return 1
+
+    logging.info(f"Total Items: {len(rows)}")
+    context = {
+        "job": "consulta",
+        "endpoint": endpoint.name,
+        "marca": marca,
+        "fbyfechaini": params["fbyfechaini"],
+        "fbyfechafin": params["fbyfechafin"],
+        "frecuencia": params.get("frecuencia", ""),
+    }
+    with metrics.phase("export"):
+        write_sink(sink, rows, context)
+    metrics.log_summary()
+    metrics.export()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Consulta del API de SICOP que reutiliza datos ya descargados")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="indicadores")
+    parser.add_argument("--marca", default=getenv("MARCA", ""))
+    parser.add_argument("--fechaini", required=True, help="Fecha inicial AAAAMMDD")
+    parser.add_argument("--fechafin", required=True, help="Fecha final AAAAMMDD")
+    parser.add_argument("--gby", help="Dimensiones separadas por coma (por defecto las del endpoint)")
+    parser.add_argument("--frecuencia", help="Frecuencia (por defecto la del endpoint)")
+    parser.add_argument("--params", default="{}", help="Parámetros adicionales en JSON")
+    parser.add_argument("--store", default=None, help="Directorio de datos locales (por defecto LOCAL_STORE_DIR)")
+    parser.add_argument("--fresh-days", type=int, default=int(getenv("LOCAL_STORE_FRESH_DAYS") or 1),
+                        help="Días recientes que siempre se piden al API")
+    parser.add_argument("--no-save", action="store_true", help="No guardar lo descargado en los datos locales")
+    parser.add_argument("--max-concurrency", type=int, default=10)
+    parser.add_argument("--sink", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--output", default=None,
+                        help="Archivo de salida (por defecto {fecha}_{endpoint}_{marca}_{fbyfechaini}_{fbyfechafin})")
+    parser.add_argument("--explain", "--dry-run", action="store_true",
+                        help="Muestra qué se responde localmente y qué se pide al API, sin tocar la red")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    endpoint = ENDPOINTS[args.endpoint]
+    params = {**endpoint.defaults, "fbyfechaini": args.fechaini, "fbyfechafin": args.fechafin}
+    if args.gby:
+        # Mismo formato que el valor por defecto del endpoint (texto separado por comas o lista)
+        params["gby"] = as_list(args.gby) if isinstance(endpoint.defaults.get("gby"), list) else args.gby
+    if args.frecuencia:
+        params["frecuencia"] = args.frecuencia
+    params.update(json.loads(args.params))
+
+    store = LocalStore(args.store) if args.store else LocalStore.from_env()
+    planner = QueryPlanner(store, args.fresh_days)
+    started = time.perf_counter()
+    steps = planner.plan(endpoint, args.marca, params)
+    local_days = sum(len(step.days) or 1 for step in steps if step.source == "local")
+    remote_days = sum(len(step.days) or 1 for step in steps if step.source == "remote")
+    logging.info(f"Plan en {time.perf_counter() - started:.4f} s: {local_days} días locales, "
+                 f"{remote_days} días del API en {sum(1 for s in steps if s.source == 'remote')} rangos")
+    if args.explain:
+        print(json.dumps([step.describe() for step in steps], indent=2, ensure_ascii=False))
+        return 0
+    output = args.output or f"{{fecha}}_{{endpoint}}_{{marca}}_{{fbyfechaini}}_{{fbyfechafin}}.{args.sink}"
+    sink = {"type": args.sink, "path": output}
+    return asyncio.run(run(planner, endpoint, args.marca, params, steps, sink, args.max_concurrency,
+                           not args.no_save))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
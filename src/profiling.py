@@ -0,0 +1,109 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import tracemalloc
+from datetime import datetime
+from os import getenv
+from os.path import join
+
+# Perfilado opcional de CPU y memoria, activado por variables de entorno sin
+# modificar los scripts:
+#
+#   PROFILE        = 'cpu,mem'      perfiles a activar (cpu, mem o ambos)
+#   PROFILE_DIR    = 'profiles'     directorio de salida
+#   PROFILE_TOP    = '25'           renglones del top de funciones / asignaciones
+#   PROFILE_POINTS = 'download,aggregation,export'   puntos donde tomar snapshots de memoria
+#
+# Por cada corrida se escribe <script>_<fecha>.prof (abrir con snakeviz o pstats),
+# <script>_<fecha>_cpu.txt con el top de funciones y <script>_<fecha>_mem.txt con
+# el top de asignaciones en cada punto y su diferencia contra el punto anterior.
+
+DEFAULT_POINTS = "download,aggregation,export"
+
+
+class Profiler:
+
+    def __init__(self, script: str, cpu: bool = False, mem: bool = False, directory: str = "profiles",
+                 top: int = 25, points=None):
+        self.script = script
+        self.cpu = cpu
+        self.mem = mem
+        self.directory = directory
+        self.top = top
+        self.points = set(points if points is not None else DEFAULT_POINTS.split(","))
+        self.profile = None
+        self.snapshots = []
+        self.prefix = f"{script}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+    @classmethod
+    def from_env(cls, script: str):
+        modes = {m.strip().lower() for m in getenv("PROFILE", "").split(",") if m.strip()}
+        points = [p.strip() for p in getenv("PROFILE_POINTS", DEFAULT_POINTS).split(",") if p.strip()]
+        return cls(script, cpu="cpu" in modes, mem="mem" in modes or "memory" in modes,
+                   directory=getenv("PROFILE_DIR", "profiles"), top=int(getenv("PROFILE_TOP", "25")),
+                   points=points)
+
+    @property
+    def enabled(self) -> bool:
+        return self.cpu or self.mem
+
+    def start(self):
+        if not self.enabled:
+            return self
+        if self.mem and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cpu:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        logging.info(f"Perfilado activo ({'cpu ' if self.cpu else ''}{'mem' if self.mem else ''}) en {self.directory}")
+        return self
+
+    def snapshot(self, point: str):
+        """Toma un snapshot de memoria si el punto está configurado en PROFILE_POINTS."""
+        if not self.mem or point not in self.points or not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        self.snapshots.append((point, tracemalloc.take_snapshot(), current, peak))
+        logging.info(f"Memoria en '{point}': actual {current / 1048576:.1f} MB, pico {peak / 1048576:.1f} MB")
+
+    def stop(self):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self.profile is not None:
+            self.profile.disable()
+            self.write_cpu_report()
+            self.profile = None
+        if self.mem and tracemalloc.is_tracing():
+            self.write_mem_report()
+            tracemalloc.stop()
+
+    def write_cpu_report(self):
+        prof_file = join(self.directory, f"{self.prefix}.prof")
+        self.profile.dump_stats(prof_file)
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats("cumulative").print_stats(self.top)
+        stats.sort_stats("tottime").print_stats(self.top)
+        report_file = join(self.directory, f"{self.prefix}_cpu.txt")
+        with open(report_file, "w", encoding="utf-8") as f:
+            f.write(stream.getvalue())
+        logging.info(f"Perfil de CPU: {prof_file}, {report_file}")
+
+    def write_mem_report(self):
+        report_file = join(self.directory, f"{self.prefix}_mem.txt")
+        previous = None
+        with open(report_file, "w", encoding="utf-8") as f:
+            for point, snapshot, current, peak in self.snapshots:
+                f.write(f"===== {point}: actual {current / 1048576:.1f} MB, pico {peak / 1048576:.1f} MB =====\n")
+                for stat in snapshot.statistics("lineno")[:self.top]:
+                    f.write(f"{stat}\n")
+                if previous is not None:
+                    f.write(f"----- Diferencia contra '{previous[0]}' -----\n")
+                    for stat in snapshot.compare_to(previous[1], "lineno")[:self.top]:
+                        f.write(f"{stat}\n")
+                f.write("\n")
+                previous = (point, snapshot)
+        logging.info(f"Reporte de memoria: {report_file}")
@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+from datetime import datetime
+from os import getenv
+from typing import TYPE_CHECKING
+
+from compression import read_body
+from metrics import RunMetrics
+from sicop import ENDPOINTS, auth_headers, credentials_from_env, get_access_token, request_plan
+from sinks import sink_filename, write_sink
+
+if TYPE_CHECKING:
+    import aiohttp
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Proceso de larga duración que consulta quickcount en tiempo real cada cierto
+# intervalo y sólo emite las filas que cambiaron desde la consulta anterior.
+#
+# - Cada página se pide con If-None-Match cuando el API regresó ETag; un 304
+#   evita descargar y decodificar la página.
+# - Si no hay ETag, se compara el hash del contenido de la página y las páginas
+#   idénticas no se decodifican.
+# - Las filas de las páginas que cambiaron se comparan por llave (fecha y
+#   dimensiones) contra el estado anterior y sólo las nuevas, modificadas o
+#   eliminadas se escriben al sink.
+#
+#   python src/quickcount_poller.py --interval 60 --output "salida/{fecha}_quickcount_delta_{marca}.jsonl"
+
+# Indicadores que siempre regresa quickcount además de los solicitados
+QUICKCOUNT_INDICADORES = list(ENDPOINTS["quickcount"].base_indicadores)
+
+
+class PageState:
+
+    def __init__(self, etag: str, digest: str, rows: list):
+        self.etag = etag
+        self.digest = digest
+        self.rows = rows
+
+
+class QuickcountPoller:
+
+    def __init__(self, marca: str, params: dict, sink: dict, max_concurrency: int = 5):
+        self.endpoint = ENDPOINTS["quickcount"]
+        self.marca = marca
+        self.params = {**self.endpoint.defaults, **params}
+        self.sink = {"append": True, **sink}
+        self.max_concurrency = max_concurrency
+        self.indicadores = set(self.params.get("indicadores") or []) | set(QUICKCOUNT_INDICADORES)
+        self.pages = {}
+        self.state = {}
+        self.token = None
+        self.cycle = 0
+
+    def authenticate(self):
+        user, client = credentials_from_env()
+        self.token = get_access_token(user, client)
+        return self.token
+
+    def sink_context(self) -> dict:
+        return {
+            "job": "quickcount_delta",
+            "endpoint": self.endpoint.name,
+            "marca": self.marca,
+            "fbyfechaini": self.params.get("fbyfechaini", ""),
+            "fbyfechafin": self.params.get("fbyfechafin", ""),
+            "frecuencia": self.params.get("frecuencia", ""),
+        }
+
+    def plan(self, interval: float, cycles: int) -> dict:
+        return {
+            "interval": interval,
+            "cycles": cycles,
+            "max_concurrency": self.max_concurrency,
+            "request": request_plan(self.endpoint, self.marca, self.params),
+            "sink": {**self.sink, "path": sink_filename(self.sink, self.sink_context())},
+        }
+
+    def row_key(self, row: dict):
+        return tuple(sorted((k, v) for k, v in row.items() if k not in self.indicadores))
+
+    async def fetch_page(self, session: "aiohttp.ClientSession", page: int, semaphore: asyncio.Semaphore,
+                         metrics: RunMetrics):
+        """Regresa (total de páginas, PageState, cambió); las filas se toman del estado si la página no cambió.
+
+        No modifica self.pages: poll() guarda los PageState sólo cuando el ciclo completo termina bien.
+        """
+        previous = self.pages.get(page)
+        headers = auth_headers(self.token)
+        if previous is not None and previous.etag:
+            headers["If-None-Match"] = previous.etag
+        body = json.dumps(self.endpoint.params(self.marca, {**self.params, "page": page}))
+        async with semaphore:
+            with metrics.phase("network") as page_timer:
+                async with session.post(self.endpoint.url(self.marca), headers=headers, data=body,
+                                        auto_decompress=False) as response:
+                    total_pages = int(response.headers.get("x-sicop-api-pages", 1))
+                    not_modified = response.status == 304 and previous is not None
+                    if not not_modified:
+                        response.raise_for_status()
+                        etag = response.headers.get("ETag")
+                        content, wire_bytes, inflate = await read_body(response)
+
+        # La latencia se registra fuera del bloque, cuando page_timer ya tiene el tiempo medido
+        if not_modified:
+            metrics.record_page(page_timer.elapsed, 0, 0)
+            return total_pages, previous, False
+
+        metrics.add_phase("decompress", inflate)
+        digest = hashlib.sha256(content).hexdigest()
+        if previous is not None and previous.digest == digest:
+            metrics.record_page(page_timer.elapsed, len(content), 0, wire_bytes, inflate)
+            return total_pages, PageState(etag, digest, previous.rows), False
+
+        with metrics.phase("decode") as decode_timer:
+            rows = self.endpoint.rows(json.loads(content))
+        metrics.record_page(page_timer.elapsed, len(content), len(rows), wire_bytes, inflate + decode_timer.elapsed)
+        return total_pages, PageState(etag, digest, rows), True
+
+    async def poll(self, session: "aiohttp.ClientSession"):
+        """Una consulta completa; regresa la lista de filas cambiadas."""
+        self.cycle += 1
+        metrics = RunMetrics("quickcount_poller", {"marca": self.marca})
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # Los PageState del ciclo se guardan en self.pages sólo al final: si una página falla, las que sí
+        # cambiaron se vuelven a comparar en el siguiente ciclo en lugar de parecer iguales a lo ya emitido
+        with metrics.phase("download"):
+            total_pages, first_state, first_changed = await self.fetch_page(session, 1, semaphore, metrics)
+            results = {1: (first_state, first_changed)}
+            if total_pages > 1:
+                responses = await asyncio.gather(*[
+                    self.fetch_page(session, page, semaphore, metrics) for page in range(2, total_pages + 1)
+                ])
+                for page, (_, page_state, changed) in enumerate(responses, start=2):
+                    results[page] = (page_state, changed)
+        # Si el total de páginas bajó las páginas sobrantes no se guardan
+        pages = {page: page_state for page, (page_state, _) in results.items()}
+
+        changed_pages = sum(1 for _, changed in results.values() if changed)
+        logging.info(f"Ciclo {self.cycle}: {changed_pages} de {total_pages} páginas con cambios")
+        if not changed_pages:
+            self.pages = pages
+            metrics.finish()
+            metrics.export()
+            return []
+
+        with metrics.phase("delta"):
+            new_state = {}
+            for page in sorted(results):
+                for row in results[page][0].rows:
+                    new_state[self.row_key(row)] = row
+            cambios = []
+            for key, row in new_state.items():
+                anterior = self.state.get(key)
+                if anterior is None:
+                    cambios.append({**row, "_cambio": "nuevo"})
+                elif any(anterior.get(k) != row.get(k) for k in self.indicadores):
+                    cambios.append({**row, "_cambio": "modificado"})
+            for key, row in self.state.items():
+                if key not in new_state:
+                    cambios.append({**dict(key), "_cambio": "eliminado"})
+            first_cycle = not self.state
+
+        if first_cycle:
+            logging.info(f"Estado inicial: {len(new_state)} filas")
+        else:
+            logging.info(f"Filas con cambios: {len(cambios)}")
+            for indicador in QUICKCOUNT_INDICADORES:
+                delta = sum(int(row.get(indicador) or 0) for row in cambios if row["_cambio"] != "eliminado")
+                logging.info(f"{indicador} en filas con cambios: {delta}")
+        if cambios:
+            with metrics.phase("export"):
+                for row in cambios:
+                    row["_ciclo"] = datetime.now().isoformat(timespec="seconds")
+                await asyncio.to_thread(write_sink, self.sink, cambios, self.sink_context())
+        self.pages = pages
+        self.state = new_state
+        metrics.finish()
+        metrics.export()
+        return cambios
+
+    async def run(self, interval: float, cycles: int = 0):
+        import aiohttp
+        if not self.authenticate():
+            return 1
+        async with aiohttp.ClientSession() as session:
+            while True:
+                started = asyncio.get_running_loop().time()
+                try:
+                    await self.poll(session)
+                except aiohttp.ClientResponseError as e:
+                    if e.status == 401:
+                        # El token expiró: se renueva y se reintenta en el siguiente ciclo
+                        logging.warning("Token expirado, obteniendo uno nuevo")
+                        self.authenticate()
+                    else:
+                        logging.error(f"Error en el ciclo {self.cycle}: {e}")
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    logging.error(f"Error en el ciclo {self.cycle}: {e}")
+                if cycles and self.cycle >= cycles:
+                    return 0
+                elapsed = asyncio.get_running_loop().time() - started
+                await asyncio.sleep(max(0.0, interval - elapsed))
+
+
+def parse_args(argv=None):
+    hoy = datetime.now().strftime("%Y%m%d")
+    parser = argparse.ArgumentParser(description="Consulta periódica de quickcount con detección de cambios")
+    parser.add_argument("--marca", default=getenv("MARCA", ""))
+    parser.add_argument("--fechaini", default=hoy, help="Fecha inicial AAAAMMDD (por defecto hoy)")
+    parser.add_argument("--fechafin", default=hoy, help="Fecha final AAAAMMDD (por defecto hoy)")
+    parser.add_argument("--params", default="{}", help="Parámetros adicionales en JSON")
+    parser.add_argument("--interval", type=float, default=60.0, help="Segundos entre consultas")
+    parser.add_argument("--cycles", type=int, default=0, help="Número de ciclos (0 = sin fin)")
+    parser.add_argument("--max-concurrency", type=int, default=5)
+    parser.add_argument("--sink", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--output", help="Archivo donde se agregan las filas con cambios "
+                                          "(por defecto {fecha}_quickcount_delta_{marca} con la extensión del sink)")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra la petición resuelta sin tocar la red")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = {"fbyfechaini": args.fechaini, "fbyfechafin": args.fechafin, **json.loads(args.params)}
+    output = args.output or f"{{fecha}}_quickcount_delta_{{marca}}.{args.sink}"
+    poller = QuickcountPoller(args.marca, params, {"type": args.sink, "path": output}, args.max_concurrency)
+    if args.dry_run:
+        print(json.dumps(poller.plan(args.interval, args.cycles), indent=2, ensure_ascii=False))
+        return 0
+    try:
+        return asyncio.run(poller.run(args.interval, args.cycles))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Control adaptativo de concurrencia (AIMD) para las descargas concurrentes:
+#
+# - Cada respuesta sana con latencia cercana a la mínima reciente sube el límite
+#   en 1/límite (aproximadamente +1 por cada ronda de peticiones).
+# - Un 429/503 reduce el límite a la mitad y pausa nuevas peticiones el tiempo
+#   indicado en Retry-After.
+# - Una latencia mayor a latency_factor veces la mínima reciente se toma como
+#   señal de saturación y reduce el límite en decrease_latency.
+#
+# Las reducciones se aplican como máximo una vez por ventana de latencia para
+# que una ráfaga de respuestas lentas no colapse el límite.
+
+RETRY_STATUS = (429, 503)
+
+
+def parse_retry_after(value, default: float = 1.0) -> float:
+    """Segundos a esperar según Retry-After (segundos o fecha HTTP)."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        fecha = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return max(0.0, (fecha - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, retry_after=None, base: float = 1.0, maximum: float = 60.0) -> float:
+    """Espera antes de un reintento: Retry-After si viene, si no backoff exponencial."""
+    if retry_after:
+        return min(maximum, parse_retry_after(retry_after, base))
+    return min(maximum, base * (2 ** attempt))
+
+
+class RateController:
+
+    def __init__(self, initial: int = 5, minimum: int = 1, maximum: int = 32, latency_factor: float = 2.0,
+                 decrease_throttle: float = 0.5, decrease_latency: float = 0.9, window: int = 100):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.decrease_throttle = decrease_throttle
+        self.decrease_latency = decrease_latency
+        self.latencies = deque(maxlen=window)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.waiters = deque()
+        self.throttled = 0
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self):
+        while True:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            if self.in_flight < self.current_limit:
+                self.in_flight += 1
+                return
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future in self.waiters:
+                    self.waiters.remove(future)
+                self.wake()
+                raise
+
+    def wake(self):
+        available = self.current_limit - self.in_flight
+        while self.waiters and available > 0:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                available -= 1
+
+    def release(self, latency: float = None, throttled: bool = False, retry_after: float = 0.0):
+        self.in_flight -= 1
+        now = time.monotonic()
+        previous = self.current_limit
+        if throttled:
+            self.throttled += 1
+            self.paused_until = max(self.paused_until, now + retry_after)
+            self.decrease(now, self.decrease_throttle)
+        elif latency is not None:
+            self.latencies.append(latency)
+            if latency > min(self.latencies) * self.latency_factor:
+                self.decrease(now, self.decrease_latency)
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+        if self.current_limit != previous:
+            logging.info(f"Concurrencia ajustada: {previous} -> {self.current_limit}")
+        self.wake()
+
+    def decrease(self, now: float, factor: float):
+        window = min(self.latencies) if self.latencies else 1.0
+        if now - self.last_decrease < window:
+            return
+        self.last_decrease = now
+        self.limit = max(float(self.minimum), self.limit * factor)
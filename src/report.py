@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from os import getenv
+from os.path import exists, getmtime, join
+
+# Reporte de totales del funnel. funnel.py y funnelGeneral.py agregan las filas
+# en un FunnelReport: cada indicador con su total y su desglose por canal
+# (piso, calle, cartera, leads), opcionalmente por una dimensión de la fila
+# (REPORT_DIMENSION, p. ej. zona o distribuidor).
+#
+# Con REPORT_DIR el reporte se guarda como JSON, uno por endpoint, marca,
+# parámetros y dimensión, para que otros procesos lean los totales sin volver a
+# descargar. Si ya existe uno para los mismos parámetros se usa en lugar de
+# descargar cuando la ventana de fechas ya cerró (termina antes de ayer) o
+# cuando tiene menos de REPORT_MAX_AGE segundos.
+#
+# Formato del archivo:
+#   totals     indicador -> {"total": ..., "piso": ..., "calle": ..., "cartera": ..., "leads": ...}
+#   breakdown  columnar: una lista por columna (dimensión, canal y un indicador
+#              por columna), un elemento por combinación de dimensión y canal
+
+REPORT_VERSION = 1
+
+CANALES = ("piso", "calle", "cartera", "leads")
+
+# Indicadores que el API desglosa por canal con el sufijo del canal
+CHANNEL_INDICADORES = ("prospectos", "asignados", "cotizaciones", "prospectosconcotizacion", "prospectosinactivos",
+                       "apartados", "citas")
+# Indicadores que sólo vienen como total
+TOTAL_INDICADORES = ("shows", "prospectoscondemo", "ventasfacturadas", "ventasentregadas", "ventasentregadasleads",
+                     "intentados", "intentadosminutos")
+
+
+def channel_field(indicador: str, canal: str) -> str:
+    # En el API los prospectos digitales vienen en "leads" y no en "prospectosleads"
+    if indicador == "prospectos" and canal == "leads":
+        return "leads"
+    return f"{indicador}{canal}"
+
+
+# (indicador, canal, campo de la fila); canal "total" es el campo sin sufijo
+FIELDS = [(indicador, "total", indicador) for indicador in CHANNEL_INDICADORES + TOTAL_INDICADORES] + [
+    (indicador, canal, channel_field(indicador, canal)) for indicador in CHANNEL_INDICADORES for canal in CANALES]
+
+
+def number(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+class FunnelReport:
+    """Suma los indicadores del funnel por canal y, si se indica, por una dimensión de la fila."""
+
+    def __init__(self, dimension: str = None):
+        self.dimension = dimension or None
+        self.groups = {}
+        self.rows = 0
+
+    def add(self, row: dict):
+        key = row.get(self.dimension) if self.dimension else None
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = dict.fromkeys((field for _, _, field in FIELDS), 0)
+        for _, _, field in FIELDS:
+            value = row.get(field)
+            # intentadosminutos puede venir nulo; algunos indicadores llegan como texto
+            if value:
+                group[field] += number(value) if isinstance(value, str) else value
+        self.rows += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def totals(self) -> dict:
+        totals = {}
+        for indicador, canal, field in FIELDS:
+            totals.setdefault(indicador, {})[canal] = sum(group[field] for group in self.groups.values())
+        return totals
+
+    def breakdown(self) -> dict:
+        columns = {"canal": []}
+        if self.dimension:
+            columns[self.dimension] = []
+        for indicador in CHANNEL_INDICADORES + TOTAL_INDICADORES:
+            columns[indicador] = []
+        for key in sorted(self.groups, key=lambda k: (k is None, str(k))):
+            group = self.groups[key]
+            for canal in ("total",) + CANALES:
+                columns["canal"].append(canal)
+                if self.dimension:
+                    columns[self.dimension].append(key)
+                for indicador in CHANNEL_INDICADORES:
+                    columns[indicador].append(group[indicador if canal == "total" else channel_field(indicador, canal)])
+                for indicador in TOTAL_INDICADORES:
+                    columns[indicador].append(group[indicador] if canal == "total" else None)
+        return columns
+
+    def to_dict(self, endpoint: str, marca: str, params: dict) -> dict:
+        return {
+            "version": REPORT_VERSION,
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "endpoint": endpoint,
+            "marca": marca,
+            "params": params,
+            "dimension": self.dimension,
+            "rows": self.rows,
+            "totals": self.totals(),
+            "breakdown": self.breakdown(),
+        }
+
+
+class ReportCache:
+    """Reportes guardados en disco, uno por endpoint, marca, parámetros y dimensión."""
+
+    def __init__(self, directory: str = None, dimension: str = None, max_age: float = 0):
+        self.directory = directory
+        self.dimension = dimension or None
+        self.max_age = max_age
+
+    @classmethod
+    def from_env(cls):
+        return cls(getenv("REPORT_DIR") or None, getenv("REPORT_DIMENSION") or None,
+                   float(getenv("REPORT_MAX_AGE") or 0))
+
+    def path(self, endpoint: str, marca: str, params: dict) -> str:
+        key = {"endpoint": endpoint, "marca": marca, "dimension": self.dimension,
+               "params": {k: v for k, v in params.items() if k != "page"}}
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        return join(self.directory, f"{endpoint}_{marca}_{digest}.json")
+
+    def load(self, endpoint: str, marca: str, params: dict) -> dict:
+        """Reporte guardado para estos parámetros si todavía sirve; None si no hay o hay que recalcular."""
+        if not self.directory:
+            return None
+        path = self.path(endpoint, marca, params)
+        if not exists(path):
+            return None
+        closed = str(params.get("fbyfechafin", "")) < (date.today() - timedelta(days=1)).strftime("%Y%m%d")
+        if not closed and time.time() - getmtime(path) >= self.max_age:
+            return None
+        with open(path, encoding="utf-8") as f:
+            report = json.load(f)
+        if report.get("version") != REPORT_VERSION:
+            return None
+        logging.info(f"Reporte reutilizado: {path}")
+        return report
+
+    def save(self, endpoint: str, marca: str, params: dict, report: dict):
+        if not self.directory:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(endpoint, marca, params)
+        # Escritura atómica para que un consumidor nunca lea un reporte a medias
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        logging.info(f"Reporte guardado: {path}")
+        return path
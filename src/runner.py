@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import sys
+from os import getenv
+
+from coalesce import Batch, coalesce
+from metrics import RunMetrics
+from ratelimit import RateController
+from sicop import ENDPOINTS, auth_headers, credentials_from_env, fetch_all_pages, get_access_token, request_plan
+from sinks import sink_filename, write_sink
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Ejecuta una lista de trabajos (endpoint, parámetros, sink) en un solo proceso
+# con un token compartido, una sola sesión HTTP, un límite global de peticiones
+# simultáneas, límites por endpoint y prioridad por trabajo.
+#
+#   python src/runner.py jobs.json
+#
+# Formato del archivo (ver jobs.example.json):
+#
+#   {
+#     "max_concurrency": 10,
+#     "endpoint_concurrency": {"funnel": 5, "quickcount": 3},
+#     "jobs": [
+#       {"name": "quickcount", "endpoint": "quickcount", "priority": 1,
+#        "params": {"fbyfechaini": "20260101", "fbyfechafin": "20260118"},
+#        "sink": {"type": "csv", "path": "salida/{fecha}_{job}_{marca}.csv"}},
+#       {"name": "indicadores20", "endpoint": "indicadores20", "sink": {"type": "mysql"}}
+#     ]
+#   }
+#
+# La prioridad menor se atiende primero; el valor por defecto es 10.
+#
+# Los trabajos de quickcount con la misma marca, fechas y demás parámetros se
+# descargan una sola vez con la unión de sus indicadores y gby, y cada uno
+# recibe sus columnas y su agrupación (coalesce.py); --no-coalesce lo desactiva.
+
+DEFAULT_PRIORITY = 10
+
+
+class Job:
+
+    def __init__(self, name: str, endpoint: str, params: dict = None, sink: dict = None, marca: str = None,
+                 priority: int = DEFAULT_PRIORITY):
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Endpoint desconocido en el trabajo '{name}': {endpoint}")
+        self.name = name
+        self.endpoint = ENDPOINTS[endpoint]
+        self.params = {**self.endpoint.defaults, **(params or {})}
+        self.sink = sink or {"type": "csv"}
+        # El sink mysql usa la tabla e inserción de app20.py, que sólo corresponden a indicadores20
+        if self.sink.get("type") == "mysql" and endpoint != "indicadores20":
+            raise ValueError(f"El sink mysql sólo aplica a indicadores20 (trabajo '{name}': {endpoint})")
+        self.marca = marca or getenv("MARCA", "")
+        self.priority = priority
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(name=data.get("name") or data["endpoint"], endpoint=data["endpoint"], params=data.get("params"),
+                   sink=data.get("sink"), marca=data.get("marca"),
+                   priority=int(data.get("priority", DEFAULT_PRIORITY)))
+
+    def context(self) -> dict:
+        return {
+            "job": self.name,
+            "endpoint": self.endpoint.name,
+            "marca": self.marca,
+            "fbyfechaini": self.params.get("fbyfechaini", ""),
+            "fbyfechafin": self.params.get("fbyfechafin", ""),
+            "frecuencia": self.params.get("frecuencia", ""),
+        }
+
+
+class PriorityLimiter:
+    """Límite global de peticiones simultáneas que entrega los lugares libres a la prioridad menor."""
+
+    def __init__(self, limit: int):
+        self.available = limit
+        self.waiters = []
+        self.counter = itertools.count()
+
+    async def acquire(self, priority: int):
+        if self.available > 0 and not self.waiters:
+            self.available -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Si el lugar ya se había entregado, se devuelve para no perderlo
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.available += 1
+
+
+class JobSlot:
+    """Lugar para una petición de un trabajo: primero el límite del endpoint y después el global."""
+
+    def __init__(self, limiter: PriorityLimiter, endpoint_semaphore: asyncio.Semaphore, priority: int):
+        self.limiter = limiter
+        self.endpoint_semaphore = endpoint_semaphore
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.endpoint_semaphore.acquire()
+        try:
+            await self.limiter.acquire(self.priority)
+        except BaseException:
+            self.endpoint_semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter.release()
+        self.endpoint_semaphore.release()
+
+
+def export_job(batch: Batch, job: Job, rows):
+    write_sink(job.sink, batch.rows_for(job, rows), job.context())
+
+
+async def run_batch(session, batch: Batch, headers: dict, slot: JobSlot, rate: RateController):
+    import aiohttp
+    metrics = RunMetrics("runner", {"job": batch.name, "marca": batch.marca})
+    try:
+        with metrics.phase("download"):
+            fulldata, total_pages = await fetch_all_pages(session, batch.endpoint, batch.marca, headers,
+                                                          batch.params, slot, metrics, rate)
+        logging.info(f"{batch.name}: {len(fulldata)} registros en {total_pages} páginas")
+        with metrics.phase("export"):
+            for job in batch.jobs:
+                await asyncio.to_thread(export_job, batch, job, fulldata)
+    except (aiohttp.ClientError, ValueError, OSError) as e:
+        metrics.record_error()
+        logging.error(f"Error en el trabajo {batch.name}: {e}")
+        metrics.finish()
+        metrics.export()
+        return batch, None
+    metrics.finish()
+    metrics.export()
+    return batch, metrics
+
+
+async def run(batches, max_concurrency: int, endpoint_concurrency: dict):
+    import aiohttp
+    metrics = RunMetrics("runner")
+
+    user, client = credentials_from_env()
+    logging.info('Get Access Token...')
+    with metrics.phase("auth"):
+        token = get_access_token(user, client)
+    if not token:
+        return 1
+
+    headers = auth_headers(token)
+    limiter = PriorityLimiter(max_concurrency)
+    endpoint_semaphores = {
+        name: asyncio.Semaphore(endpoint_concurrency.get(name, max_concurrency)) for name in ENDPOINTS
+    }
+    # Control adaptativo por endpoint, con el límite del endpoint como tope
+    endpoint_rates = {
+        name: RateController(initial=min(5, endpoint_concurrency.get(name, max_concurrency)),
+                             maximum=endpoint_concurrency.get(name, max_concurrency))
+        for name in ENDPOINTS
+    }
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        with metrics.phase("download"):
+            results = await asyncio.gather(*[
+                run_batch(session, batch, headers,
+                          JobSlot(limiter, endpoint_semaphores[batch.endpoint.name], batch.priority),
+                          endpoint_rates[batch.endpoint.name])
+                for batch in sorted(batches, key=lambda b: b.priority)
+            ])
+
+    failed = [job.name for batch, job_metrics in results if job_metrics is None for job in batch.jobs]
+    for _, job_metrics in results:
+        if job_metrics is not None:
+            metrics.merge(job_metrics)
+    metrics.errors += len(failed)
+    if failed:
+        logging.error(f"Trabajos con error: {', '.join(failed)}")
+    metrics.log_summary()
+    metrics.export()
+    return 1 if failed else 0
+
+
+def plan(batches, max_concurrency: int, endpoint_concurrency: dict) -> dict:
+    """Trabajos en el orden en que se atienden, con la petición y el archivo de salida ya resueltos.
+
+    Los trabajos agrupados comparten la misma petición y el mismo nombre de batch.
+    """
+    return {
+        "max_concurrency": max_concurrency,
+        "endpoint_concurrency": {name: endpoint_concurrency.get(name, max_concurrency) for name in ENDPOINTS},
+        "jobs": [
+            {
+                "name": job.name,
+                "priority": job.priority,
+                "batch": batch.name,
+                "request": request_plan(batch.endpoint, batch.marca, batch.params),
+                "sink": {**job.sink, "path": sink_filename(job.sink, job.context())},
+            }
+            for batch in sorted(batches, key=lambda b: b.priority)
+            for job in batch.jobs
+        ],
+    }
+
+
+def load_jobs(job_file: str):
+    with open(job_file, encoding="utf-8") as f:
+        config = json.load(f)
+    jobs = [Job.from_dict(job) for job in config.get("jobs", [])]
+    return jobs, int(config.get("max_concurrency", 10)), config.get("endpoint_concurrency", {})
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ejecuta varios trabajos del API de SICOP en un solo proceso")
+    parser.add_argument("jobs", help="Archivo JSON con la lista de trabajos")
+    parser.add_argument("--max-concurrency", type=int, help="Sobrescribe el límite global del archivo")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra el plan de trabajos sin tocar la red")
+    parser.add_argument("--no-coalesce", action="store_true",
+                        help="Una descarga por trabajo aunque varios pidan los mismos datos")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    jobs, max_concurrency, endpoint_concurrency = load_jobs(args.jobs)
+    if not jobs:
+        logging.error(f"No hay trabajos en {args.jobs}")
+        return 2
+    batches = [Batch([job]) for job in jobs] if args.no_coalesce else coalesce(jobs)
+    if args.dry_run:
+        print(json.dumps(plan(batches, args.max_concurrency or max_concurrency, endpoint_concurrency), indent=2,
+                         ensure_ascii=False))
+        return 0
+    return asyncio.run(run(batches, args.max_concurrency or max_concurrency, endpoint_concurrency))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
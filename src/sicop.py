@@ -0,0 +1,343 @@
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import time
+from os import getenv
+from typing import TYPE_CHECKING
+
+from dotenv import load_dotenv
+
+from compression import ACCEPT_ENCODING, read_body
+from hedging import HedgePolicy
+from metrics import RunMetrics
+from ratelimit import RETRY_STATUS, RateController, backoff_delay
+from snapshot import MAX_RESNAPSHOTS, RowIndex, page_hashes, shift_marker
+
+if TYPE_CHECKING:
+    import aiohttp
+
+load_dotenv()
+
+# Cliente compartido del API de SICOP: credenciales, token de acceso y descarga
+# asíncrona de endpoints paginados. Una sola sesión HTTP y un solo semáforo se
+# pueden compartir entre varias marcas o endpoints en el mismo proceso.
+#
+# requests y aiohttp se importan dentro de las funciones que los usan: importar
+# este módulo (para resolver URLs y parámetros o en --dry-run) no los carga.
+
+
+def get_env_var(key: str, default: str = "") -> str:
+    value = getenv(key, default)
+    if not value:
+        logging.warning(f"La variable de entorno '{key}' no está definida o vacía. Usando valor por defecto.")
+    return value
+
+
+URL_API_BASE = get_env_var("URL_API_BASE", "https://api.sicopweb.com")
+URL_AUTH_ENDPOINT = f"{URL_API_BASE}/auth/v3/token"
+
+# Reintentos ante 429/503 o timeout antes de dar la página por perdida
+MAX_RETRIES = 5
+
+# Segundos máximos por petición de página en las descargas concurrentes (0 sin límite)
+PAGE_TIMEOUT = float(getenv("PAGE_TIMEOUT") or 60)
+
+
+class UserCredentials:
+
+    def __init__(self, email: str, pwd: str):
+        self.email = email
+        self.pwd = pwd
+
+
+class ClientCredentials:
+
+    def __init__(self, client_id: str, secret_key: str):
+        self.client_id = client_id
+        self.secret_key = secret_key
+
+
+def credentials_from_env():
+    user = UserCredentials(email=get_env_var("EMAIL_USER"), pwd=get_env_var("PWD_USER"))
+    client = ClientCredentials(client_id=get_env_var("CLIENT_ID"), secret_key=get_env_var("SECRET_KEY"))
+    return user, client
+
+
+def get_access_token(user_credentials: UserCredentials, client_credentials: ClientCredentials):
+    data = {
+        "email": user_credentials.email,
+        "pwd": user_credentials.pwd,
+        "client_id": client_credentials.client_id,
+        "secret_key": client_credentials.secret_key,
+    }
+    # Encabezados de la solicitud
+    headers = {"Content-type": "application/x-www-form-urlencoded"}
+
+    import requests
+    try:
+        response = requests.post(URL_AUTH_ENDPOINT, data=data, headers=headers)
+        response.raise_for_status()
+        respuesta_json = response.json()
+        token = respuesta_json.get("token")
+        if not token:
+            raise ValueError("Token no presente en la respuesta")
+        return token
+    except Exception as e:
+        logging.error(f"Error al obtener el token de acceso: {e}")
+        return None
+
+
+def auth_headers(token: str) -> dict:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {token}",
+        "Accept-Encoding": ACCEPT_ENCODING,
+    }
+
+
+class Endpoint:
+    """Forma de un endpoint paginado: método, ruta (con {marca} si aplica) y si los datos vienen en un sobre."""
+
+    def __init__(self, name: str, method: str, path: str, envelope: str = None, defaults: dict = None,
+                 dated: bool = False, dimension_fields: dict = None, non_additive=(), base_indicadores=()):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.envelope = envelope
+        # Parámetros por defecto (los mismos que usan los scripts individuales)
+        self.defaults = defaults or {}
+        # Filas con anio/mes/dia: una consulta se puede partir por rangos de fechas
+        self.dated = dated
+        # Campos que regresa cada elemento de gby cuando no se llaman igual (p. ej. ejecutivo -> idejecutivo)
+        self.dimension_fields = dimension_fields or {}
+        # Indicadores que no se pueden sumar al agrupar por menos dimensiones (promedios, tasas)
+        self.non_additive = tuple(non_additive)
+        # Indicadores que el endpoint regresa aunque no se pidan
+        self.base_indicadores = tuple(base_indicadores)
+
+    def url(self, marca: str) -> str:
+        return f"{URL_API_BASE}{self.path.format(marca=marca)}"
+
+    def params(self, marca: str, params: dict) -> dict:
+        # Los endpoints de funnel reciben la marca como parámetro "origen"
+        if "{marca}" not in self.path:
+            return {"origen": marca, **params}
+        return dict(params)
+
+    def rows(self, body):
+        if self.envelope:
+            if not isinstance(body, dict):
+                raise ValueError("Respuesta inesperada: se esperaba un diccionario.")
+            return body.get(self.envelope, [])
+        if not isinstance(body, list):
+            raise ValueError("Respuesta inesperada: se esperaba una lista de diccionarios.")
+        return body
+
+
+ENDPOINTS = {
+    "indicadores": Endpoint("indicadores", "POST", "/bi/prod/indicadores/{marca}/nacional", defaults={
+        "frecuencia": "DIARIA",
+        "gby": "zona,region,plaza,distribuidor,auto,fuenteinformacion,subcampana",
+    }, dated=True),
+    "indicadores20": Endpoint("indicadores20", "POST", "/bi/prod/indicadores20/{marca}/nacional", defaults={
+        "frecuencia": "DIARIA",
+        "gby": "zona,region,plaza,distribuidor,auto,fuenteinformacion,subcampana,ejecutivo",
+    }, dated=True, dimension_fields={"ejecutivo": ["idejecutivo", "ejecutivo"]},
+        non_additive=["tiempopromediointentados"]),
+    "funnel": Endpoint("funnel", "GET", "/funnel/prod/indicadores/nacional/detalle"),
+    "funnelgeneral": Endpoint("funnelgeneral", "GET", "/funnel/v8/indicadores/nacional/detalle/general"),
+    "quickcount": Endpoint("quickcount", "POST", "/bi/qa/rt/quickcount/{marca}", envelope="data", defaults={
+        "frecuencia": "DIARIA",
+        "typedate": "FUNNEL",
+        "indicadores": ["prospectos", "intentados", "citas", "contactados", "descartados", "rechazados", "shows",
+                        "programacionserviciopv", "programacionserviciopvdomic", "showenagencia",
+                        "showendomicilio", "intentocontacto", "confirmacionserviciopv"],
+        "gby": ["zona", "region", "plaza", "distribuidor", "auto", "fuente", "subcampana"],
+    }, dated=True, base_indicadores=["prospectosnuevos", "prospectosmodificados", "citas"]),
+}
+
+
+def request_plan(endpoint: Endpoint, marca: str, params: dict) -> dict:
+    """Petición de la primera página ya resuelta (método, URL y parámetros), sin tocar la red."""
+    return {
+        "endpoint": endpoint.name,
+        "method": endpoint.method,
+        "url": endpoint.url(marca),
+        "params": endpoint.params(marca, {**params, "page": 1}),
+    }
+
+
+def request_with_retry(method: str, url: str, metrics: RunMetrics = None, max_retries: int = MAX_RETRIES,
+                       **kwargs):
+    """Petición síncrona (requests) que reintenta 429/503 respetando Retry-After."""
+    import requests
+    for attempt in range(max_retries + 1):
+        response = requests.request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUS or attempt == max_retries:
+            break
+        delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+        logging.warning(f"HTTP {response.status_code}, reintento en {delay:.1f} s")
+        if metrics is not None:
+            metrics.record_retry()
+        time.sleep(delay)
+    response.raise_for_status()
+    return response
+
+
+async def send_request(session: "aiohttp.ClientSession", endpoint: Endpoint, marca: str, headers: dict,
+                       request: dict, retry: bool = True):
+    """Una petición completa; regresa (status, encabezados, cuerpo, bytes en red, segundos de descompresión).
+
+    Con retry y un 429/503 no se lee el cuerpo: el status y Retry-After bastan para reintentar.
+    """
+    # Se descomprime por bloques en read_body para contar los bytes que viajan por la red
+    async with session.request(endpoint.method, endpoint.url(marca), headers=headers, auto_decompress=False,
+                               **request) as response:
+        if retry and response.status in RETRY_STATUS:
+            return response.status, response.headers, b"", 0, 0.0
+        response.raise_for_status()
+        body, wire_bytes, inflate = await read_body(response)
+        return response.status, response.headers, body, wire_bytes, inflate
+
+
+async def fetch_page(session: "aiohttp.ClientSession", endpoint: Endpoint, marca: str, headers: dict, params: dict,
+                     semaphore: asyncio.Semaphore, metrics: RunMetrics, rate: RateController = None,
+                     max_retries: int = MAX_RETRIES, page_timeout: float = PAGE_TIMEOUT, hedge: HedgePolicy = None):
+    """Descarga una página con reintentos; page_timeout corta las peticiones atoradas y hedge duplica las lentas."""
+    import aiohttp
+    request_params = endpoint.params(marca, params)
+    if endpoint.method == "GET":
+        request = {"params": request_params}
+    else:
+        request = {"data": json.dumps(request_params)}
+    if page_timeout:
+        request["timeout"] = aiohttp.ClientTimeout(total=page_timeout)
+
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        latency = None
+        status = None
+        send = functools.partial(send_request, session, endpoint, marca, headers, request, attempt < max_retries)
+        # El control adaptativo va antes del semáforo para no ocupar lugares globales mientras espera
+        if rate is not None:
+            await rate.acquire()
+        try:
+            async with semaphore:
+                with metrics.phase("network") as page_timer:
+                    try:
+                        if hedge is not None:
+                            status, response_headers, body, wire_bytes, inflate = await hedge.run(send, metrics)
+                        else:
+                            status, response_headers, body, wire_bytes, inflate = await send()
+                    except asyncio.TimeoutError:
+                        metrics.record_timeout()
+                        if attempt == max_retries:
+                            raise aiohttp.ServerTimeoutError(f"Timeout de {page_timeout} s en la página "
+                                                             f"{params.get('page', 1)}")
+                        retry_after = backoff_delay(attempt)
+                    if status in RETRY_STATUS:
+                        retry_after = backoff_delay(attempt, response_headers.get("Retry-After"))
+                latency = page_timer.elapsed
+        finally:
+            if rate is not None:
+                # Un timeout no pausa las peticiones, pero su latencia reduce el límite
+                rate.release(latency, throttled=status in RETRY_STATUS,
+                             retry_after=retry_after if status in RETRY_STATUS else 0.0)
+        if retry_after is None:
+            break
+        # Se espera fuera del semáforo para no bloquear a otras páginas
+        metrics.record_retry()
+        reason = f"HTTP {status}" if status else f"timeout de {page_timeout} s"
+        logging.warning(f"{endpoint.name} {marca} página {params.get('page', 1)}: {reason}, "
+                        f"reintento en {retry_after:.1f} s")
+        await asyncio.sleep(retry_after)
+
+    if hedge is not None:
+        hedge.observe(latency)
+    current_page = int(response_headers.get("x-sicop-api-current-page", params.get("page", 1)))
+    total_pages = int(response_headers.get("x-sicop-api-pages", 1))
+    metrics.add_phase("decompress", inflate)
+    with metrics.phase("decode") as decode_timer:
+        data = endpoint.rows(json.loads(body))
+    metrics.record_page(latency, len(body), len(data), wire_bytes, inflate + decode_timer.elapsed)
+    logging.info(f"{endpoint.name} {marca} Página: {current_page} de {total_pages}, Total Items: {len(data)}, "
+                 f"Bytes: {wire_bytes} en red, {len(body)} descomprimidos")
+    return current_page, total_pages, data
+
+
+async def fetch_all_pages(session: "aiohttp.ClientSession", endpoint: Endpoint, marca: str, headers: dict,
+                          common_params: dict, semaphore: asyncio.Semaphore, metrics: RunMetrics,
+                          rate: RateController = None, max_resnapshots: int = MAX_RESNAPSHOTS,
+                          page_timeout: float = PAGE_TIMEOUT, hedge: HedgePolicy = None):
+    """Descarga la primera página para conocer el total y el resto de forma concurrente, en orden de página.
+
+    Si x-sicop-api-pages cambia a mitad de la descarga se vuelven a pedir las páginas obtenidas antes del cambio
+    (las que reportaron otro total y las que llegaron antes de una fila repetida entre páginas) y las nuevas; en
+    ese caso las filas repetidas entre páginas se descartan por hash. Sin cambio del total no se descarta nada.
+    Con hedge, una página que tarda más que el percentil de latencia de la política se pide dos veces.
+    """
+    import aiohttp
+    order = itertools.count()
+
+    async def fetch(page: int):
+        params = {**common_params, "page": page}
+        _, page_total, data = await fetch_page(session, endpoint, marca, headers, params, semaphore, metrics, rate,
+                                               page_timeout=page_timeout, hedge=hedge)
+        return page_total, next(order), data, page_hashes(data)
+
+    # página -> (total de páginas que reportó, orden de llegada, filas, hashes de las filas)
+    results = {1: await fetch(1)}
+    total_pages = results[1][0]
+    failed = set()
+    pending = list(range(2, total_pages + 1))
+    previous_total = total_pages
+    changed = False
+
+    for attempt in range(max_resnapshots + 1):
+        responses = await asyncio.gather(*[fetch(page) for page in pending], return_exceptions=True)
+        for page, response in zip(pending, responses):
+            if isinstance(response, (aiohttp.ClientError, ValueError)):
+                failed.add(page)
+                metrics.record_error()
+                logging.error(f"Error en la página {page} de {endpoint.name} {marca}: {response}")
+            elif isinstance(response, BaseException):
+                raise response
+            else:
+                failed.discard(page)
+                results[page] = response
+        # El total vigente es el de la respuesta más reciente
+        total_pages = max(results.values(), key=lambda r: r[1])[0]
+        for page in [p for p in results if p > total_pages]:
+            del results[page]
+        # Una fila repetida entre páginas sólo indica un recorrido si el total también cambió; con los datos
+        # estáticos puede ser una fila que el API regresa dos veces
+        round_changed = total_pages != previous_total or len({r[0] for r in results.values()}) > 1
+        changed = changed or round_changed
+        previous_total = total_pages
+        shifted = shift_marker(results) if round_changed else -1
+        stale = [p for p, (page_total, arrival, _, _) in results.items()
+                 if page_total != total_pages or arrival < shifted]
+        missing = [p for p in range(1, total_pages + 1) if p not in results and p not in failed]
+        if not stale and not missing:
+            break
+        if attempt == max_resnapshots:
+            logging.warning(f"{endpoint.name} {marca}: los datos siguieron cambiando, "
+                            f"{len(stale)} páginas pueden estar desfasadas")
+            break
+        logging.warning(f"{endpoint.name} {marca}: los datos cambiaron durante la descarga ({total_pages} páginas), "
+                        f"se vuelven a pedir {len(stale)} páginas y se piden {len(missing)} nuevas")
+        metrics.record_refetch(len(stale))
+        pending = sorted(stale + missing)
+
+    index = RowIndex()
+    fulldata = []
+    for page in sorted(results.keys()):
+        _, _, data, hashes = results[page]
+        fulldata.extend(index.unique(data, hashes) if changed else data)
+    if index.duplicates:
+        metrics.record_duplicates(index.duplicates)
+        logging.warning(f"{endpoint.name} {marca}: {index.duplicates} filas repetidas entre páginas descartadas")
+
+    return fulldata, total_pages
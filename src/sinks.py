@@ -0,0 +1,109 @@
+import csv
+import json
+import logging
+import os
+from datetime import datetime
+from os.path import dirname
+
+# Destinos de los datos descargados. Cada sink recibe la lista de filas y el
+# nombre del archivo ("append": true agrega al final en lugar de reemplazar);
+# la ruta puede incluir {fecha}, {endpoint}, {marca},
+# {job}, {fbyfechaini}, {fbyfechafin} y {frecuencia}. Las filas pueden ser
+# cualquier iterable (p. ej. un SpillBuffer) y se escriben sin copiarlas a una lista.
+#
+# El sink mysql no escribe archivo: carga las filas de indicadores20 en
+# sicopdb.analisisdiariobdc con la misma inserción que app20.py (sin "append"
+# vacía la tabla antes, igual que app20.py).
+
+# Tabla que llena el sink mysql (se muestra como destino en --dry-run)
+MYSQL_TARGET = "mysql:sicopdb.analisisdiariobdc"
+
+
+def csv_header(filename: str) -> list:
+    """Columnas del encabezado de un CSV existente (vacío si el archivo no tiene renglones)."""
+    with open(filename, newline='', encoding='utf-8') as csvfile:
+        return next(csv.reader(csvfile, delimiter='|'), [])
+
+
+def export_to_csv(data_list, filename: str, append: bool = False):
+    """Genera un archivo CSV con separador pipe (|) a partir de la lista de datos.
+
+    Al agregar a un archivo existente se usan las columnas de su encabezado; una fila con columnas que el
+    encabezado no tiene es un error (ValueError) para no desalinear ni perder valores.
+    """
+    rows = iter(data_list)
+    first = next(rows, None)
+    if first is None:
+        logging.warning(f"No hay datos para exportar a {filename}.")
+        return None
+
+    headers = csv_header(filename) if append and os.path.exists(filename) else []
+    write_header = not headers
+    if write_header:
+        # Headers de las keys del primer elemento. Al agregar, las llamadas siguientes reutilizan este encabezado,
+        # así que se toman de todas las filas (en el poller las eliminadas no traen los indicadores)
+        headers = dict.fromkeys(first.keys())
+        if append and isinstance(data_list, list):
+            for row in data_list:
+                headers.update(dict.fromkeys(row))
+        headers = list(headers)
+    with open(filename, 'a' if append else 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=headers, delimiter='|', restval='')
+        if write_header:
+            writer.writeheader()
+        writer.writerow(first)
+        writer.writerows(rows)
+
+    logging.info(f"Archivo CSV generado: {filename}")
+    return filename
+
+
+def export_to_jsonl(data_list, filename: str, append: bool = False):
+    """Genera un archivo JSON Lines (un objeto por renglón)."""
+    if not data_list:
+        logging.warning(f"No hay datos para exportar a {filename}.")
+        return None
+
+    with open(filename, 'a' if append else 'w', encoding='utf-8') as f:
+        for row in data_list:
+            f.write(json.dumps(row, ensure_ascii=False))
+            f.write("\n")
+
+    logging.info(f"Archivo JSONL generado: {filename}")
+    return filename
+
+
+def export_to_mysql(data_list, target: str, append: bool = False):
+    """Carga las filas en MySQL con app20.load_rows; app20 y mysql.connector se importan sólo al usarlo."""
+    import app20
+    app20.load_rows(data_list, append=append)
+    logging.info(f"Filas cargadas en {target}")
+    return target
+
+
+SINKS = {
+    "csv": export_to_csv,
+    "jsonl": export_to_jsonl,
+    "mysql": export_to_mysql,
+}
+# Sinks que escriben a una base de datos y no a un archivo
+DB_SINKS = ("mysql",)
+
+
+def sink_filename(sink: dict, context: dict) -> str:
+    if sink.get("type") == "mysql":
+        return MYSQL_TARGET
+    extension = sink.get("type", "csv")
+    pattern = sink.get("path") or f"{{fecha}}_{{job}}_{{fbyfechaini}}_{{fbyfechafin}}.{extension}"
+    values = {"fecha": datetime.now().strftime("%Y-%m-%d"), **context}
+    return pattern.format_map(values)
+
+
+def write_sink(sink: dict, data_list, context: dict):
+    sink_type = sink.get("type", "csv")
+    if sink_type not in SINKS:
+        raise ValueError(f"Sink desconocido: {sink_type}")
+    filename = sink_filename(sink, context)
+    if sink_type not in DB_SINKS and dirname(filename):
+        os.makedirs(dirname(filename), exist_ok=True)
+    return SINKS[sink_type](data_list, filename, append=bool(sink.get("append", False)))
@@ -0,0 +1,116 @@
+import json
+import logging
+
+# Consistencia de la paginación. Si el API agrega o quita filas mientras se
+# descarga, las filas se recorren entre páginas: una página pedida después del
+# cambio puede repetir filas de la anterior o dejar huecos, y los totales de
+# prospectos/ventas salen mal sin ningún error.
+#
+# - RowIndex guarda el hash de cada fila ya aceptada y descarta las repetidas.
+#   Se usa la fila completa para no descartar nunca datos distintos. El API sí
+#   puede regresar dos filas agregadas idénticas, así que las repetidas sólo se
+#   descartan cuando el conjunto cambió durante la descarga; con los datos
+#   estáticos se conservan todas.
+# - Un cambio en x-sicop-api-pages indica que el conjunto cambió. Las páginas
+#   obtenidas antes del cambio pueden tener huecos o filas con valores viejos:
+#   los recorridos secuenciales descartan todo lo acumulado y empiezan de nuevo,
+#   y las descargas concurrentes vuelven a pedir esas páginas.
+
+# Veces que se vuelve a pedir la descarga ante un cambio del total de páginas
+MAX_RESNAPSHOTS = 3
+
+
+def row_hash(row: dict) -> int:
+    # Las filas de un endpoint traen las mismas llaves en el mismo orden: basta con los valores
+    try:
+        return hash(tuple(row.values()))
+    except TypeError:
+        # Valores no hasheables (p. ej. listas): se usa el JSON de la fila
+        return hash(json.dumps(row, sort_keys=True))
+
+
+def page_hashes(rows) -> list:
+    return [row_hash(row) for row in rows]
+
+
+def shift_marker(results: dict) -> int:
+    """Orden de llegada más reciente entre dos páginas que comparten filas (-1 si no hay repetidas).
+
+    results es página -> (total de páginas, orden de llegada, filas, hashes de las filas). Cuando el total de
+    páginas cambió, una fila en dos páginas indica que las filas se recorrieron entre ambas descargas, así que
+    las páginas que llegaron antes pueden tener huecos. Sin cambio del total no se usa: el API puede regresar
+    dos filas idénticas.
+    """
+    first_seen = {}
+    marker = -1
+    for page in sorted(results):
+        _, arrival, _, hashes = results[page]
+        for key in hashes:
+            other = first_seen.setdefault(key, page)
+            if other != page:
+                marker = max(marker, arrival, results[other][1])
+    return marker
+
+
+class RowIndex:
+    """Índice de hashes de fila para descartar las repetidas entre páginas."""
+
+    def __init__(self):
+        self.seen = set()
+        self.duplicates = 0
+
+    def unique(self, rows, hashes: list = None) -> list:
+        """Filas que no se habían visto; hashes permite pasar los ya calculados con page_hashes."""
+        result = []
+        for row, key in zip(rows, hashes if hashes is not None else map(row_hash, rows)):
+            if key in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(key)
+            result.append(row)
+        return result
+
+    def reset(self):
+        """Olvida las filas vistas (al descartar lo acumulado en un reinicio)."""
+        self.seen = set()
+        self.duplicates = 0
+
+
+class SnapshotGuard(RowIndex):
+    """Para los recorridos secuenciales: pide reiniciar si cambia el total de páginas y, desde ese momento,
+    descarta las filas repetidas.
+
+    Al reiniciar, quien llama descarta las filas acumuladas: las filas pudieron cambiar de valor junto con el
+    total y la versión vieja y la nueva de una misma fila no tienen el mismo hash.
+    """
+
+    def __init__(self, total_pages: int, max_restarts: int = MAX_RESNAPSHOTS):
+        super().__init__()
+        self.total_pages = total_pages
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self.changed = False
+
+    def unique(self, rows, hashes: list = None) -> list:
+        """Filas sin las repetidas si el total de páginas ya cambió; si no, todas las filas."""
+        if self.changed:
+            return super().unique(rows, hashes)
+        # Los hashes se guardan para descartar repetidas si el total cambia más adelante sin reinicio
+        rows = list(rows)
+        self.seen.update(hashes if hashes is not None else map(row_hash, rows))
+        return rows
+
+    def check(self, response):
+        """Regresa (total de páginas, reiniciar); reiniciar es True si el total cambió y quedan reintentos."""
+        reported = int(response.headers.get('x-sicop-api-pages', self.total_pages))
+        if reported == self.total_pages:
+            return self.total_pages, False
+        logging.warning(f"El total de páginas cambió de {self.total_pages} a {reported} durante la descarga")
+        self.total_pages = reported
+        self.changed = True
+        if self.restarts >= self.max_restarts:
+            logging.warning("Se alcanzó el máximo de reinicios; se continúa con el nuevo total")
+            return self.total_pages, False
+        self.restarts += 1
+        self.reset()
+        return self.total_pages, True
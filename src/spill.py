@@ -0,0 +1,116 @@
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import weakref
+from os import getenv
+from os.path import join
+
+# Acumulador de filas con presupuesto de memoria para descargas grandes.
+#
+# Se usa en lugar de la lista fulldata: extend() agrega las filas de cada página
+# y, cuando las filas en memoria llegan a MEMORY_BUDGET_ROWS, se escriben como
+# un segmento en disco (SPILL_DIR o el directorio temporal del sistema). Al
+# recorrerlo se leen los segmentos uno por uno y al final las filas en memoria,
+# en el mismo orden en que se agregaron, así que la agregación y la exportación
+# no necesitan tener todas las filas en memoria a la vez.
+#
+# Cada segmento guarda las llaves una sola vez por bloque de filas con las
+# mismas columnas y las filas como tuplas de valores, lo que ocupa bastante
+# menos que los diccionarios originales. Sin MEMORY_BUDGET_ROWS (o con 0) nunca
+# se escribe a disco y se comporta como una lista.
+
+SEGMENT_PREFIX = "segmento_"
+
+
+class SpillBuffer:
+
+    def __init__(self, budget_rows: int = 0, directory: str = None):
+        self.budget_rows = budget_rows
+        self.directory = directory
+        self.rows = []
+        self.segments = []
+        self.spilled_rows = 0
+        self.path = None
+        self._finalizer = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(budget_rows=int(getenv("MEMORY_BUDGET_ROWS") or 0), directory=getenv("SPILL_DIR") or None)
+
+    def __len__(self) -> int:
+        return self.spilled_rows + len(self.rows)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self):
+        for segment in self.segments:
+            with open(segment, "rb") as f:
+                blocks = pickle.load(f)
+            for keys, values in blocks:
+                for row in values:
+                    yield dict(zip(keys, row))
+        yield from self.rows
+
+    def append(self, row: dict):
+        self.rows.append(row)
+        self.check_budget()
+
+    def extend(self, rows):
+        self.rows.extend(rows)
+        self.check_budget()
+
+    def check_budget(self):
+        if self.budget_rows and len(self.rows) >= self.budget_rows:
+            self.spill()
+
+    def spill(self):
+        """Escribe las filas en memoria como un nuevo segmento y las libera."""
+        if not self.rows:
+            return
+        if self.path is None:
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+            self.path = tempfile.mkdtemp(prefix="sicop_spill_", dir=self.directory)
+            # Los segmentos se borran aunque no se llame a close()
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, True)
+        blocks = []
+        keys = None
+        for row in self.rows:
+            row_keys = tuple(row.keys())
+            if row_keys != keys:
+                keys = row_keys
+                blocks.append((keys, []))
+            blocks[-1][1].append(tuple(row.values()))
+        segment = join(self.path, f"{SEGMENT_PREFIX}{len(self.segments):05d}.pkl")
+        with open(segment, "wb") as f:
+            pickle.dump(blocks, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.segments.append(segment)
+        self.spilled_rows += len(self.rows)
+        self.rows = []
+
+    def log_summary(self):
+        if self.segments:
+            logging.info(f"Filas escritas a disco: {self.spilled_rows} en {len(self.segments)} segmentos "
+                         f"(presupuesto {self.budget_rows} filas en memoria)")
+
+    def clear(self):
+        """Descarta todas las filas, en memoria y en disco; el buffer se puede seguir usando."""
+        self.rows = []
+        self.segments = []
+        self.spilled_rows = 0
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+            self.path = None
+
+    def close(self):
+        self.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,41 @@
+from coalesce import Batch, coalesce, coalesce_key, ordered_union
+from runner import Job
+
+PARAMS = {"fbyfechaini": "20260101", "fbyfechafin": "20260118"}
+
+
+def job(name: str, endpoint: str = "quickcount", marca: str = "TEST", **params) -> Job:
+    return Job(name, endpoint, {**PARAMS, **params}, marca=marca)
+
+
+def test_ordered_union():
+    assert ordered_union([["b", "a"], ["c", "a"]]) == ["b", "a", "c"]
+    assert ordered_union([["c", "a"], ["b"]], reference=["a", "b", "z"]) == ["a", "b", "c"]
+
+
+def test_key_ignores_indicadores_and_gby():
+    first = job("a", indicadores=["citas"], gby=["zona"])
+    second = job("b", indicadores=["prospectos"], gby=["zona", "region"])
+    assert coalesce_key(first) == coalesce_key(second)
+
+
+def test_key_separates_other_params():
+    assert coalesce_key(job("a")) != coalesce_key(job("b", fbyfechafin="20260119"))
+    assert coalesce_key(job("a")) != coalesce_key(job("b", marca="OTRA"))
+
+
+def test_only_quickcount_is_coalesced():
+    assert coalesce_key(job("a", endpoint="funnel")) is None
+
+
+def test_coalesce_batches():
+    jobs = [job("a", gby=["zona"]), job("b", endpoint="funnel"), job("c", gby=["region"])]
+    batches = coalesce(jobs)
+    assert [[j.name for j in batch.jobs] for batch in batches] == [["a", "c"], ["b"]]
+    assert batches[0].params["gby"] == ["zona", "region"]
+
+
+def test_batch_rows_for_single_job():
+    batch = Batch([job("a")])
+    rows = [{"zona": "Z"}]
+    assert batch.rows_for(batch.jobs[0], rows) is rows
@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import pytest
+
+from quickcount_poller import QuickcountPoller
+
+
+class Content:
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_chunked(self, size):
+        yield self.body
+
+
+class Response:
+
+    def __init__(self, status: int, body: bytes = b"", headers: dict = None):
+        self.status = status
+        self.headers = headers or {}
+        self.content = Content(body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise ValueError(f"HTTP {self.status}")
+
+
+class Session:
+    """Responde cada página con las filas de pages; las páginas en failing regresan 500."""
+
+    def __init__(self, pages: dict):
+        self.pages = pages
+        self.failing = set()
+
+    def post(self, url, headers=None, data=None, **kwargs):
+        page = json.loads(data)["page"]
+        if page in self.failing:
+            return Response(500)
+        body = json.dumps({"data": self.pages[page]}).encode()
+        return Response(200, body, {"x-sicop-api-pages": str(len(self.pages))})
+
+
+def row(zona: str, citas: int) -> dict:
+    return {"anio": 2026, "mes": 1, "dia": 1, "zona": zona, "citas": citas}
+
+
+@pytest.fixture
+def poller(tmp_path):
+    poller = QuickcountPoller("TEST", {}, {"type": "jsonl", "path": str(tmp_path / "delta.jsonl")})
+    poller.token = "token"
+    return poller
+
+
+def test_unchanged_cycle_returns_nothing(poller):
+    session = Session({1: [row("A", 1)], 2: [row("B", 1)]})
+    assert len(asyncio.run(poller.poll(session))) == 2
+    assert asyncio.run(poller.poll(session)) == []
+
+
+def test_delta_survives_failed_cycle(poller):
+    session = Session({1: [row("A", 1)], 2: [row("B", 1)]})
+    asyncio.run(poller.poll(session))
+
+    session.pages[1] = [row("A", 5)]
+    session.failing = {2}
+    with pytest.raises(ValueError):
+        asyncio.run(poller.poll(session))
+
+    session.failing = set()
+    cambios = asyncio.run(poller.poll(session))
+    assert [(c["zona"], c["citas"], c["_cambio"]) for c in cambios] == [("A", 5, "modificado")]
+    assert asyncio.run(poller.poll(session)) == []
+
+
+def test_removed_rows(poller):
+    session = Session({1: [row("A", 1), row("B", 1)]})
+    asyncio.run(poller.poll(session))
+    session.pages[1] = [row("A", 1)]
+    cambios = asyncio.run(poller.poll(session))
+    assert [(c["zona"], c["_cambio"]) for c in cambios] == [("B", "eliminado")]
@@ -0,0 +1,71 @@
+import asyncio
+
+from ratelimit import RateController, backoff_delay, parse_retry_after
+
+
+def released(controller: RateController, **kwargs) -> RateController:
+    controller.in_flight += 1
+    controller.release(**kwargs)
+    return controller
+
+
+def test_additive_increase():
+    controller = RateController(initial=4, maximum=8)
+    released(controller, latency=0.1)
+    assert controller.limit == 4.25
+    for _ in range(40):
+        released(controller, latency=0.1)
+    assert controller.current_limit == 8
+
+
+def test_throttle_halves_and_pauses():
+    controller = RateController(initial=8)
+    released(controller, throttled=True, retry_after=5)
+    assert controller.current_limit == 4
+    assert controller.throttled == 1
+    assert controller.paused_until > 0
+
+
+def test_one_decrease_per_window():
+    controller = RateController(initial=8)
+    released(controller, latency=1.0)
+    released(controller, throttled=True)
+    released(controller, throttled=True)
+    assert controller.current_limit == 4
+
+
+def test_high_latency_decreases():
+    controller = RateController(initial=10, decrease_latency=0.9)
+    released(controller, latency=0.001)
+    limit = controller.limit
+    released(controller, latency=1.0)
+    assert controller.limit == limit * 0.9
+
+
+def test_minimum_limit():
+    controller = RateController(initial=1, minimum=1)
+    released(controller, throttled=True)
+    assert controller.current_limit == 1
+
+
+def test_acquire_waits_for_release():
+    async def scenario():
+        controller = RateController(initial=1)
+        await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        controller.release(latency=0.01)
+        await asyncio.wait_for(waiter, 1)
+        return controller.in_flight
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None, 2.0) == 2.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert backoff_delay(3) == 8.0
+    assert backoff_delay(10) == 60.0
+    assert backoff_delay(0, "7") == 7.0
@@ -0,0 +1,33 @@
+from planner import rollup
+from sicop import ENDPOINTS
+
+QUICKCOUNT = ENDPOINTS["quickcount"]
+STORED = {"gby": ["zona", "distribuidor"], "indicadores": ["prospectos", "citas"]}
+
+
+def row(distribuidor: str, prospectos, citas=None, zona: str = "Z") -> dict:
+    return {"anio": 2026, "mes": 1, "dia": 1, "zona": zona, "distribuidor": distribuidor,
+            "prospectos": prospectos, "citas": citas}
+
+
+def test_same_gby_returns_rows():
+    rows = [row("D1", 1)]
+    assert rollup(QUICKCOUNT, rows, STORED, STORED) is rows
+
+
+def test_sums_numeric_strings_by_field_name():
+    rows = [row("D1", "3"), row("D2", "3"), row("D3", "5")]
+    result = rollup(QUICKCOUNT, rows, STORED, {"gby": ["zona"], "indicadores": ["prospectos", "citas"]})
+    assert result == [{"anio": 2026, "mes": 1, "dia": 1, "zona": "Z", "prospectos": 11, "citas": 0}]
+
+
+def test_groups_by_requested_dimensions():
+    rows = [row("D1", 1, 2, zona="N"), row("D2", 2, 1, zona="N"), row("D3", 4, 0, zona="S")]
+    result = rollup(QUICKCOUNT, rows, STORED, {"gby": ["zona"], "indicadores": ["prospectos", "citas"]})
+    assert {r["zona"]: (r["prospectos"], r["citas"]) for r in result} == {"N": (3, 3), "S": (4, 0)}
+
+
+def test_drops_indicators_not_requested():
+    rows = [row("D1", 1, 2), row("D2", 2, 1)]
+    result = rollup(QUICKCOUNT, rows, STORED, {"gby": ["zona"], "indicadores": ["citas"]})
+    assert result == [{"anio": 2026, "mes": 1, "dia": 1, "zona": "Z", "citas": 3}]
@@ -0,0 +1,54 @@
+from snapshot import RowIndex, SnapshotGuard, page_hashes, shift_marker
+
+
+class Response:
+
+    def __init__(self, total_pages: int):
+        self.headers = {"x-sicop-api-pages": str(total_pages)}
+
+
+def row(zona: str, citas: int = 1) -> dict:
+    return {"zona": zona, "citas": citas}
+
+
+def test_static_total_keeps_identical_rows():
+    guard = SnapshotGuard(2)
+    rows = guard.unique([row("A"), row("B")])
+    assert guard.check(Response(2)) == (2, False)
+    rows += guard.unique([row("B"), row("C")])
+    assert len(rows) == 4
+    assert guard.duplicates == 0
+
+
+def test_changed_total_restarts_and_resets():
+    guard = SnapshotGuard(2)
+    guard.unique([row("A"), row("B")])
+    assert guard.check(Response(3)) == (3, True)
+    assert guard.restarts == 1
+    assert guard.seen == set()
+    # Después del cambio las filas repetidas sí se descartan
+    rows = guard.unique([row("A"), row("B")]) + guard.unique([row("B"), row("C")])
+    assert rows == [row("A"), row("B"), row("C")]
+    assert guard.duplicates == 1
+
+
+def test_changed_total_without_restarts_drops_rows_seen_before():
+    guard = SnapshotGuard(2, max_restarts=0)
+    rows = guard.unique([row("A"), row("B")])
+    assert guard.check(Response(3)) == (3, False)
+    rows += guard.unique([row("B"), row("C")])
+    assert rows == [row("A"), row("B"), row("C")]
+
+
+def test_row_index_distinguishes_values():
+    index = RowIndex()
+    assert index.unique([row("A", 1), row("A", 2), row("A", 1)]) == [row("A", 1), row("A", 2)]
+    assert index.duplicates == 1
+
+
+def test_shift_marker():
+    pages = {1: [row("A"), row("B")], 2: [row("B"), row("C")]}
+    results = {page: (2, arrival, rows, page_hashes(rows)) for arrival, (page, rows) in enumerate(pages.items())}
+    assert shift_marker(results) == 1
+    results[2] = (2, 1, [row("C")], page_hashes([row("C")]))
+    assert shift_marker(results) == -1